@@ -0,0 +1,358 @@
+"""End-to-end throughput and latency benchmarks for the bridge pipeline.
+
+Starts the MQTT broker stand-in (or uses an existing broker), the mock API
+and the bridge as subprocesses on localhost, drives them with an
+in-process publisher and writes the results as JSON so runs can be
+compared::
+
+    python3 benchmark.py                        # all scenarios
+    python3 benchmark.py queue e2e --rate 1000  # selected scenarios
+    python3 benchmark.py --compare bench_results/<previous>.json
+
+Scenarios:
+    queue     enqueue cost of the durable queue as the backlog grows
+    e2e       MQTT -> API latency percentiles and sustained throughput
+    recovery  time to drain a backlog built up during an API outage
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import paho.mqtt.client as mqtt
+import requests
+
+from durable_queue import SegmentedLog, pending_count
+
+RESULTS_DIR = "bench_results"
+HERE = os.path.dirname(os.path.abspath(__file__))
+# benchmark readings come from this elevator, warm-up readings from 0
+BENCH_ELEVATOR = 1
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listening on port {port} after {timeout}s")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def reading(seq):
+    """A reading that fits the binary queue record exactly, so the queue is
+    measured in its default format. Send times are kept by ``seq`` outside
+    the payload (see Stack.sent)."""
+    return {
+        "position": seq % 10 + 1,
+        "door_status": "closed",
+        "weight": seq % 300,
+        "maintenance_mode": False,
+        "elevator_id": BENCH_ELEVATOR,
+        "seq": seq,
+    }
+
+
+class Stack:
+    """Broker (unless external), mock API and bridge on localhost."""
+
+    def __init__(self, workdir, broker_port=None, bridge_env=None):
+        self.workdir = workdir
+        self.procs = []
+        self.api_port = free_port()
+        self.api = f"http://127.0.0.1:{self.api_port}"
+        self.queue_dir = os.path.join(workdir, "queue")
+        self.external_broker = broker_port is not None
+        self.broker_port = broker_port or free_port()
+        self.bridge_env = bridge_env or {}
+        self.sent = {}  # seq -> publish time
+
+    def _spawn(self, name, script, env):
+        log = open(os.path.join(self.workdir, f"{name}.log"), "w")
+        full_env = os.environ.copy()
+        full_env.update(env)
+        proc = subprocess.Popen(
+            [sys.executable, "-u", os.path.join(HERE, script)],
+            stdout=log, stderr=log, env=full_env, cwd=self.workdir,
+        )
+        self.procs.append((proc, log))
+
+    def __enter__(self):
+        if not self.external_broker:
+            self._spawn("broker", "mqtt_broker.py", {"BROKER_PORT": str(self.broker_port)})
+        wait_for_port(self.broker_port)
+        self._spawn("api", "mock_api.py", {"API_PORT": str(self.api_port)})
+        wait_for_port(self.api_port)
+        env = {
+            "MQTT_BROKER": "127.0.0.1",
+            "MQTT_PORT": str(self.broker_port),
+            "API_URL": f"{self.api}/elevator-data",
+            "QUEUE_DIR": self.queue_dir,
+            "FLUSH_INTERVAL": "0.5",
+            "RETRY_MAX_DELAY": "1.0",
+        }
+        env.update(self.bridge_env)
+        self._spawn("bridge", "bridge.py", env)
+
+        self.client = mqtt.Client()
+        self.client.connect("127.0.0.1", self.broker_port)
+        self.client.loop_start()
+        # The bridge is ready once a warm-up reading makes it to the API.
+        base = self.count()
+        deadline = time.time() + 15
+        while self.count() == base:
+            if time.time() > deadline:
+                raise RuntimeError("bridge did not forward the warm-up reading")
+            self.publish(dict(reading(0), elevator_id=0))
+            time.sleep(0.2)
+        return self
+
+    def __exit__(self, *exc):
+        self.client.loop_stop()
+        self.client.disconnect()
+        for proc, log in reversed(self.procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            log.close()
+
+    def publish(self, payload):
+        self.client.publish("elevator/sensor_data", json.dumps(payload))
+
+    def count(self):
+        return requests.get(f"{self.api}/received/count", timeout=2).json()["count"]
+
+    def set_down(self, down):
+        requests.post(f"{self.api}/simulate_failure", json={"down": down}, timeout=2)
+
+    def wait_count(self, target, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.count() >= target:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def received_since(self, since):
+        items = []
+        while True:
+            page = requests.get(
+                f"{self.api}/received", params={"since": since, "limit": 5000}, timeout=10
+            ).json()
+            if not page:
+                return items
+            items.extend(page)
+            since = page[-1]["seq"] + 1
+
+
+def publish_at_rate(stack, count, rate, start_seq=0):
+    interval = 1.0 / rate if rate else 0.0
+    start = time.perf_counter()
+    for n in range(count):
+        if interval:
+            delay = start + n * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        stack.sent[start_seq + n] = time.time()
+        stack.publish(reading(start_seq + n))
+    return time.perf_counter() - start
+
+
+# -- scenarios -------------------------------------------------------------
+
+def bench_queue(args):
+    """Per-append cost of the durable queue at increasing backlog sizes."""
+    results = []
+    workdir = tempfile.mkdtemp(prefix="bench-queue-")
+    try:
+        log = SegmentedLog(os.path.join(workdir, "q"))
+        sample = reading(0)
+        for size in args.backlog_sizes:
+            while len(log) < size:
+                log.append(sample)
+            start = time.perf_counter()
+            for _ in range(args.queue_samples):
+                log.append(sample)
+            log.sync()
+            elapsed = time.perf_counter() - start
+            results.append({
+                "backlog": size,
+                "append_us": elapsed / args.queue_samples * 1e6,
+            })
+        start = time.perf_counter()
+        drained = 0
+        while True:
+            entries = log.read(500)
+            if not entries:
+                break
+            log.commit(entries[-1][0])
+            drained += len(entries)
+        elapsed = time.perf_counter() - start
+        log.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"append": results, "read_commit_per_s": drained / elapsed if elapsed else None}
+
+
+def bench_e2e(args):
+    """Latency and throughput with the API healthy."""
+    workdir = tempfile.mkdtemp(prefix="bench-e2e-")
+    try:
+        with Stack(workdir, args.broker_port) as stack:
+            base = stack.count()
+            total = int(args.rate * args.duration)
+            publish_s = publish_at_rate(stack, total, args.rate)
+            delivered_all = stack.wait_count(base + total, timeout=args.settle)
+            items = [i for i in stack.received_since(base) if i["data"].get("elevator_id") == BENCH_ELEVATOR]
+            sent = stack.sent
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = sorted((i["ts"] - sent[i["data"]["seq"]]) * 1000 for i in items)
+    span = items[-1]["ts"] - sent[items[0]["data"]["seq"]] if items else 0
+    return {
+        "target_rate": args.rate,
+        "published": total,
+        "delivered": len(items),
+        "complete": delivered_all,
+        "publish_seconds": publish_s,
+        "throughput_per_s": len(items) / span if span else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def bench_recovery(args):
+    """Drain time for a backlog accumulated while the API was down."""
+    workdir = tempfile.mkdtemp(prefix="bench-recovery-")
+    try:
+        with Stack(workdir, args.broker_port) as stack:
+            stack.set_down(True)
+            base = stack.count()
+            publish_at_rate(stack, args.backlog, 0)
+            deadline = time.time() + args.settle
+            while pending_count(stack.queue_dir) < args.backlog and time.time() < deadline:
+                time.sleep(0.1)
+            queued = pending_count(stack.queue_dir)
+            start = time.perf_counter()
+            stack.set_down(False)
+            complete = stack.wait_count(base + queued, timeout=args.settle)
+            drain_s = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "backlog": args.backlog,
+        "queued": queued,
+        "complete": complete,
+        "drain_seconds": drain_s,
+        "drain_per_s": queued / drain_s if drain_s else None,
+    }
+
+
+SCENARIOS = {"queue": bench_queue, "e2e": bench_e2e, "recovery": bench_recovery}
+
+
+# -- reporting ---------------------------------------------------------------
+
+def flatten(data, prefix=""):
+    out = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(flatten(value, name + "."))
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, dict):
+                    out.update(flatten(item, f"{name}[{i}]."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[name] = value
+    return out
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    print(f"\nComparison with {baseline_path}:")
+    for key in sorted(new):
+        if key in old and old[key]:
+            change = (new[key] - old[key]) / old[key] * 100
+            print(f"  {key:45s} {old[key]:12.3f} -> {new[key]:12.3f} ({change:+.1f}%)")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--broker-port", type=int, help="use an existing broker on this port")
+    parser.add_argument("--rate", type=float, default=500, help="e2e publish rate (msg/s)")
+    parser.add_argument("--duration", type=float, default=10, help="e2e publish duration (s)")
+    parser.add_argument("--backlog", type=int, default=5000, help="recovery backlog size")
+    parser.add_argument("--backlog-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queue-samples", type=int, default=2000)
+    parser.add_argument("--settle", type=float, default=60, help="max wait for delivery (s)")
+    parser.add_argument("--output", help="results file (default: bench_results/<timestamp>.json)")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in args.scenarios or list(SCENARIOS):
+        print(f"Running {name} ...", flush=True)
+        results[name] = SCENARIOS[name](args)
+        print(json.dumps(results[name], indent=2), flush=True)
+
+    report = {
+        "timestamp": time.time(),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,818 @@
 import json
 import time
 import os
+import queue
+import random
+import signal
+import sys
 import threading
 import requests
+from requests.adapters import HTTPAdapter
 import paho.mqtt.client as mqtt
 import logging
 
-BROKER = "localhost"
-PORT = 1883
-TOPIC_DATA = "elevator/sensor_data"
+from durable_queue import SegmentedLog
+from traffic_capture import CaptureWriter
+from metrics import LogLimiter, Registry, start_metrics_server
+from validation import validate_event, validate_reading
+
+BROKER = os.getenv("MQTT_BROKER", "localhost")
+PORT = int(os.getenv("MQTT_PORT", "1883"))
+# prepended to every topic, so several setups can share one broker
+TOPIC_PREFIX = os.getenv("TOPIC_PREFIX", "")
+TOPIC_DATA = TOPIC_PREFIX + "elevator/sensor_data"
+# per-elevator topics published by the simulator's fleet mode
+TOPIC_FLEET_DATA = TOPIC_PREFIX + "elevator/+/sensor_data"
+# error/alarm events, forwarded on their own priority lane (see EventLane)
+TOPIC_EVENTS = TOPIC_PREFIX + "elevator/events"
+TOPIC_FLEET_EVENTS = TOPIC_PREFIX + "elevator/+/events"
+# Bridges started with the same SHARE_GROUP use an MQTT shared subscription,
+# so the broker splits the messages between them (see bridge_supervisor.py)
+SHARE_GROUP = os.getenv("SHARE_GROUP", "")
+# At-least-once intake: a persistent MQTT session (stable client id,
+# clean_session=0) subscribed at QoS 1, where each message is acknowledged
+# to the broker only once it was forwarded or fsynced to the queue
+DURABLE_INTAKE = os.getenv("DURABLE_INTAKE", "").lower() in ("1", "true", "yes")
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", "elevator-bridge" if DURABLE_INTAKE else "")
 API_URL = os.getenv("API_URL", "http://localhost:5000/elevator-data")
+QUEUE_DIR = os.getenv("QUEUE_DIR", "bridge_queue")
+# legacy single-file queue, migrated into QUEUE_DIR on startup if present
 QUEUE_FILE = os.getenv("QUEUE_FILE", "bridge_queue.jsonl")
+# what gets queued while readings can't be forwarded: "all" keeps every
+# reading, "collapse" merges consecutive readings with the same state per
+# elevator, "latest" keeps only the newest reading per elevator
+BACKLOG_POLICY = os.getenv("BACKLOG_POLICY", "all")
+# forward and queue payloads as the original bytes instead of parsing and
+# re-serializing them; validation is left to the API (see is_passthrough)
+PASSTHROUGH = os.getenv("PASSTHROUGH", "").lower() in ("1", "true", "yes")
+# readings rejected for good (invalid, or refused by the API with a 4xx) are
+# appended here as JSON lines with the reason instead of being retried
+DEAD_LETTER_FILE = os.getenv("DEAD_LETTER_FILE", os.path.join(QUEUE_DIR, "dead_letter.jsonl"))
 FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "2.0"))
+API_BATCH_URL = os.getenv("API_BATCH_URL", API_URL.rstrip("/") + "/batch")
+FLUSH_BATCH_SIZE = int(os.getenv("FLUSH_BATCH_SIZE", "500"))
+EVENTS_API_URL = os.getenv("EVENTS_API_URL", API_URL.rstrip("/").rsplit("/", 1)[0] + "/elevator-events")
+EVENTS_QUEUE_DIR = os.getenv("EVENTS_QUEUE_DIR", os.path.join(QUEUE_DIR, "events"))
+# retry cap for the events lane, kept short so an alarm queued during an
+# outage goes out soon after the API is back
+EVENTS_RETRY_MAX_DELAY = float(os.getenv("EVENTS_RETRY_MAX_DELAY", "5.0"))
+# in-memory hand-off between the MQTT loop and the HTTP senders
+CHANNEL_SIZE = int(os.getenv("CHANNEL_SIZE", "1000"))
+SENDER_WORKERS = int(os.getenv("SENDER_WORKERS", "4"))
+# circuit breaker / retry scheduling while the API is unreachable
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60.0"))
+# Prometheus-style metrics endpoint; METRICS_PORT=0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# max per-message log lines per second for each message kind (0 = no limit)
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "5"))
+# record every MQTT message received to this file, for replay with
+# traffic_capture.py
+CAPTURE_FILE = os.getenv("CAPTURE_FILE")
+# tag in front of each log line (the supervisor names its workers)
+LOG_NAME = os.getenv("LOG_NAME", "bridge")
 
-# basic logging to stdout (captured by environment.py)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [bridge] %(levelname)s: %(message)s"
-)
 logger = logging.getLogger(__name__)
+log_limited = LogLimiter(logger, LOG_RATE_LIMIT).log_limited
+
+metrics = Registry()
+received_total = metrics.counter("bridge_messages_received_total", "MQTT messages received")
+forwarded_total = metrics.counter("bridge_messages_forwarded_total", "Readings accepted by the API")
+queued_total = metrics.counter("bridge_messages_queued_total", "Readings appended to the durable queue")
+dropped_total = metrics.counter("bridge_messages_dropped_total", "Readings lost because they could not be queued")
+coalesced_total = metrics.counter("bridge_messages_coalesced_total", "Readings merged into an earlier queued reading")
+invalid_total = metrics.counter("bridge_messages_invalid_total", "MQTT payloads that were not valid readings")
+dead_lettered_total = metrics.counter("bridge_messages_dead_lettered_total", "Readings written to the dead-letter file")
+send_seconds = metrics.histogram("bridge_try_send_seconds", "Latency of single-reading API requests")
+events_forwarded_total = metrics.counter("bridge_events_forwarded_total", "Events accepted by the API")
+event_send_seconds = metrics.histogram("bridge_event_send_seconds", "Latency of event API requests")
+event_delivery_seconds = metrics.histogram("bridge_event_delivery_seconds",
+                                           "Time from receiving an event to the API accepting it")
+persist_seconds = metrics.histogram("bridge_queue_append_seconds", "Time to append one reading to the durable queue")
+
+class CircuitBreaker:
+    """Shared view of API health used by the senders and the flush loop.
+
+    After ``threshold`` consecutive failures the breaker opens: senders stop
+    calling the API and enqueue directly, and the flush loop waits an
+    exponentially growing, jittered delay before sending a single probe.
+    The first success closes the breaker again and sets ``wakeup``.
+    """
+
+    def __init__(self, threshold, base_delay, max_delay, wakeup=None, name="API"):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.wakeup = wakeup
+        self.name = name
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._attempt = 0
+        self._retry_at = 0.0
+
+    def is_open(self):
+        return self._failures >= self.threshold
+
+    def retry_delay(self):
+        """Seconds until the next probe is allowed (0 when closed)."""
+        if not self.is_open():
+            return 0.0
+        return max(0.0, self._retry_at - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            was_open = self.is_open()
+            self._failures = 0
+            self._attempt = 0
+        if was_open:
+            logger.info("%s reachable again, circuit closed", self.name)
+            if self.wakeup is not None:
+                self.wakeup.set()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.threshold:
+                return
+            self._attempt += 1
+            delay = min(self.max_delay, self.base_delay * 2 ** (self._attempt - 1))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            self._retry_at = time.monotonic() + delay
+        logger.warning("Circuit open, next %s probe in %.1fs", self.name, delay)
+
+class BacklogCoalescer:
+    """Per-elevator runs of readings held back from the durable queue.
+
+    Under the ``collapse`` policy a reading with the same position, door and
+    maintenance state as the elevator's open run is merged into it; any other
+    reading seals the run into the queue and starts a new one. Under
+    ``latest`` every reading is merged. A sealed run is the run's newest
+    reading plus ``"coalesced": {count, first_ts, last_ts}`` when it stands
+    for more than one reading.
+
+    Open runs are newer than anything queued for their elevator, so they are
+    sealed once the drain has worked through the queue. Until then they are
+    kept in a small snapshot file next to the queue so a crash doesn't lose
+    them.
+    """
+
+    def __init__(self, policy, path):
+        self.policy = policy
+        self.path = path
+        self._lock = threading.Lock()
+        self._runs = {}  # elevator_id -> [payload, count, first_ts, last_ts]
+        self._dirty = False
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for payload, count, first_ts, last_ts in json.load(f):
+                    self._runs[payload.get("elevator_id")] = [payload, count, first_ts, last_ts]
+
+    def __len__(self):
+        return len(self._runs)
+
+    def add(self, payload, log):
+        """Queue ``payload`` into ``log`` according to the policy.
+
+        Returns True if it was merged into an open run.
+        """
+        key = payload.get("elevator_id") if isinstance(payload, dict) else None
+        if not isinstance(key, (int, str, type(None))):
+            log.append(payload)
+            return False
+        coalescable = (
+            self.policy != "all" and isinstance(payload, dict)
+            and "coalesced" not in payload
+            and all(k in payload for k in ("position", "door_status"))
+        )
+        now = time.time()
+        with self._lock:
+            if not coalescable:
+                if key in self._runs:
+                    self._seal(key, log)
+                log.append(payload)
+                return False
+            run = self._runs.get(key)
+            if run is not None and (self.policy == "latest" or _state(run[0]) == _state(payload)):
+                run[0] = payload
+                run[1] += 1
+                run[3] = now
+                self._dirty = True
+                return True
+            if run is not None:
+                self._seal(key, log)
+            self._runs[key] = [payload, 1, now, now]
+            self._dirty = True
+            return False
+
+    def _seal(self, key, log):
+        payload, count, first_ts, last_ts = self._runs.pop(key)
+        if count > 1:
+            payload = dict(payload, coalesced={"count": count, "first_ts": first_ts, "last_ts": last_ts})
+        log.append(payload, ts=first_ts)
+        self._dirty = True
+
+    def seal(self, log):
+        """Move every open run into ``log``; return how many were moved."""
+        with self._lock:
+            keys = list(self._runs)
+            for key in keys:
+                self._seal(key, log)
+        if keys:
+            log.sync()
+            self.save()
+        return len(keys)
+
+    def save(self):
+        """Write the open runs to the snapshot file if they changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            if not self._runs:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(list(self._runs.values()), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+def _state(payload):
+    return payload.get("position"), payload.get("door_status"), payload.get("maintenance_mode")
 
-queue_lock = threading.Lock()
-queue = []
+flush_wakeup = threading.Event()
+breaker = CircuitBreaker(BREAKER_THRESHOLD, RETRY_BASE_DELAY, RETRY_MAX_DELAY, flush_wakeup)
+metrics.gauge("bridge_circuit_open", "1 while the API circuit breaker is open",
+              lambda: int(breaker.is_open()))
+backlog = None
+coalescer = None
+events = None
+# (payload, mid) pairs; mid is the MQTT message id still to be acknowledged
+# under DURABLE_INTAKE, else None
+channel = queue.Queue(maxsize=CHANNEL_SIZE)
+mqtt_client = None
+capture = None
+_http = threading.local()
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+def get_session():
+    """Return this thread's keep-alive HTTP session."""
+    session = getattr(_http, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http.session = session
+    return session
+
+def ack(mid):
+    """Acknowledge a QoS 1 message to the broker (DURABLE_INTAKE only)."""
+    if mid is not None:
+        mqtt_client.ack(mid, 1)
+
+def post(url, payload, timeout):
+    """POST ``payload`` as JSON; passthrough bytes are sent unchanged."""
+    if isinstance(payload, bytes):
+        return get_session().post(url, data=payload, headers=JSON_HEADERS, timeout=timeout)
+    return get_session().post(url, json=payload, timeout=timeout)
 
 def load_queue():
-    if not os.path.exists(QUEUE_FILE):
-        logger.info("Queue file not found: %s (starting empty)", QUEUE_FILE)
+    global backlog, coalescer
+    backlog = SegmentedLog(QUEUE_DIR)
+    coalescer = BacklogCoalescer(BACKLOG_POLICY, os.path.join(QUEUE_DIR, "runs.json"))
+    if os.path.exists(QUEUE_FILE):
+        migrated = 0
+        with open(QUEUE_FILE, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    backlog.append(json.loads(line))
+                    migrated += 1
+        backlog.sync()
+        os.remove(QUEUE_FILE)
+        logger.info("Migrated %d queued items from %s", migrated, QUEUE_FILE)
+    logger.info("Opened queue %s (%d unacked items, %d held runs, policy=%s)",
+                QUEUE_DIR, len(backlog), len(coalescer), BACKLOG_POLICY)
+    if PASSTHROUGH and BACKLOG_POLICY != "all":
+        logger.warning("PASSTHROUGH readings are queued as they are; BACKLOG_POLICY=%s does not apply to them",
+                       BACKLOG_POLICY)
+
+def queue_depth():
+    return len(backlog) + len(coalescer) if backlog is not None else 0
+
+def events_depth():
+    return len(events) if events is not None else 0
+
+def oldest_age():
+    ts = backlog.oldest_timestamp() if backlog is not None else None
+    return time.time() - ts if ts is not None else 0.0
+
+metrics.gauge("bridge_queue_depth", "Unacked readings in the durable queue", queue_depth)
+metrics.gauge("bridge_queue_oldest_age_seconds", "Age of the oldest unacked reading", oldest_age)
+metrics.gauge("bridge_events_queue_depth", "Events not yet accepted by the API", events_depth)
+
+def health():
+    return {
+        "status": "ok",
+        "queue_depth": queue_depth(),
+        "events_queue_depth": events_depth(),
+        "circuit_open": breaker.is_open(),
+        "forwarded": forwarded_total.value,
+    }
+
+_dead_letter_lock = threading.Lock()
+
+def dead_letter(payload, reason):
+    """Record a reading that must not be retried, with the reason."""
+    if isinstance(payload, bytes):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            payload = payload.decode(errors="replace")
+    line = json.dumps({"ts": time.time(), "reason": reason, "payload": payload}) + "\n"
+    try:
+        with _dead_letter_lock, open(DEAD_LETTER_FILE, "a") as f:
+            f.write(line)
+    except OSError as e:
+        logger.error("Could not write to dead-letter file, dropping reading: %s", e)
+    dead_lettered_total.inc()
+    log_limited(logging.WARNING, "Dead-lettered reading: %s", reason)
+
+def is_rejection(status):
+    # 4xx means the API will never accept this reading; timeouts and rate
+    # limiting are the exceptions and get retried like 5xx
+    return 400 <= status < 500 and status not in (408, 429)
+
+def rejection_reason(resp):
+    try:
+        return f"API returned {resp.status_code}: {resp.json().get('error')}"
+    except (ValueError, AttributeError):
+        return f"API returned {resp.status_code}"
+
+def enqueue(payload, mid=None):
+    """Queue ``payload``; with a ``mid`` it is fsynced, then acknowledged."""
+    try:
+        with persist_seconds.time():
+            if isinstance(payload, bytes):
+                # passthrough bytes are stored as they are, never merged
+                backlog.append(payload)
+                merged = False
+            else:
+                merged = coalescer.add(payload, backlog)
+            if mid is not None:
+                backlog.sync()
+                coalescer.save()
+    except OSError as e:
+        dropped_total.inc()
+        # left unacknowledged, so the broker delivers it again after a restart
+        logger.error("Could not queue payload, dropping it: %s", e)
         return
-    with open(QUEUE_FILE, "r") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                queue.append(json.loads(line))
-    logger.info("Loaded %d queued items from %s", len(queue), QUEUE_FILE)
-
-def persist_queue():
-    with open(QUEUE_FILE, "w") as f:
-        for item in queue:
-            f.write(json.dumps(item) + "\n")
-    logger.info("Persisted %d queued items to %s", len(queue), QUEUE_FILE)
-
-def enqueue(payload):
-    with queue_lock:
-        queue.append(payload)
-        persist_queue()
-    logger.warning("Enqueued payload (queue size=%d)", len(queue))
+    ack(mid)
+    queued_total.inc()
+    if merged:
+        coalesced_total.inc()
+    log_limited(logging.WARNING, "Enqueued payload (queue size=%d)", queue_depth())
 
 def try_send(payload):
+    """Forward one reading; return False if it should be queued for retry."""
     try:
-        resp = requests.post(API_URL, json=payload, timeout=2)
-        ok = resp.status_code == 200
-        if ok:
-            logger.info("Forwarded payload to API (200)")
-        else:
-            logger.warning("API returned %s", resp.status_code)
-        return ok
+        with send_seconds.time():
+            resp = post(API_URL, payload, timeout=2)
     except requests.RequestException as e:
-        logger.warning("API request failed: %s", e)
+        log_limited(logging.WARNING, "API request failed: %s", e)
+        breaker.record_failure()
         return False
+    ok = resp.status_code == 200
+    if ok:
+        forwarded_total.inc()
+        log_limited(logging.INFO, "Forwarded payload to API (200)")
+        breaker.record_success()
+    elif is_rejection(resp.status_code):
+        dead_letter(payload, rejection_reason(resp))
+        return True
+    else:
+        log_limited(logging.WARNING, "API returned %s", resp.status_code)
+        if resp.status_code >= 500:
+            breaker.record_failure()
+    return ok
+
+def try_send_batch(items):
+    """POST ``items`` to the batch endpoint.
+
+    Returns a list of per-item booleans (False: retry the item later), or
+    None if the whole request failed (API down, timeout, unexpected
+    response), which counts as a breaker failure so the next attempt is
+    backed off. Items the API rejected are dead-lettered and count as done;
+    a batch rejected as a whole is retried one item at a time, so only the
+    offending items end up there. Passthrough items (JSON bytes) are joined
+    into the body as they are.
+    """
+    body = b"[" + b",".join(items) + b"]" if PASSTHROUGH else items
+    try:
+        resp = post(API_BATCH_URL, body, timeout=10)
+        if is_rejection(resp.status_code):
+            logger.warning("Batch API rejected the batch with %s, sending items one by one", resp.status_code)
+            breaker.record_success()
+            return [False if breaker.is_open() else try_send(item) for item in items]
+        if resp.status_code != 200:
+            logger.warning("Batch API returned %s", resp.status_code)
+            breaker.record_failure()
+            return None
+        results = resp.json()["results"]
+        statuses = [r.get("status") for r in results]
+    except requests.RequestException as e:
+        logger.warning("Batch API request failed: %s", e)
+        breaker.record_failure()
+        return None
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning("Batch API returned an unexpected body: %s", e)
+        breaker.record_failure()
+        return None
+    if len(results) != len(items):
+        logger.warning("Batch API returned %d results for %d items", len(results), len(items))
+        breaker.record_failure()
+        return None
+    breaker.record_success()
+    done = []
+    for item, result, status in zip(items, results, statuses):
+        if status == 200:
+            done.append(True)
+        elif isinstance(status, int) and is_rejection(status):
+            dead_letter(item, f"API returned {status}: {result.get('error')}")
+            done.append(True)
+        else:
+            done.append(False)
+    accepted = statuses.count(200)
+    forwarded_total.inc(accepted)
+    logger.info("Forwarded batch to API (%d/%d accepted)", accepted, len(items))
+    return done
+
+def drain_queue():
+    """Send the current backlog in FIFO batches until it is empty or a
+    request fails.
+
+    A failed request leaves the batch unacked. Items the API rejected are
+    dead-lettered; items that failed for another reason are re-appended at
+    the tail so only they stay queued. The budget keeps re-appended items
+    from being retried within the same drain.
+    Once the items queued at the start have been sent, the coalescer's open
+    runs are sealed and sent as well. Records are read from disk outside any
+    lock, so enqueues never wait on the network calls made here.
+    """
+    budget = len(backlog)
+    sealed = False
+    while True:
+        if budget <= 0:
+            if sealed:
+                break
+            sealed = True
+            budget = coalescer.seal(backlog)
+            if not budget:
+                break
+        entries = backlog.read(min(FLUSH_BATCH_SIZE, budget), raw=PASSTHROUGH)
+        if not entries:
+            break
+        items = []
+        for _, item in entries:
+            # readings queued before validation moved into the bridge (in
+            # passthrough mode the API does the validating)
+            error = None if PASSTHROUGH else validate_reading(item)
+            if error:
+                dead_letter(item, error)
+            else:
+                items.append(item)
+        results = try_send_batch(items) if items else []
+        if results is None:
+            break
+        retried = [item for item, ok in zip(items, results) if not ok]
+        for item in retried:
+            backlog.append(item)
+        if retried:
+            # the originals were durable: make the copies so before the
+            # commit below lets the originals go
+            backlog.sync()
+        backlog.commit(entries[-1][0])
+        budget -= len(entries)
+    logger.info("Flush complete (remaining=%d)", queue_depth())
 
 def flush_queue():
+    # Healthy API: drain every FLUSH_INTERVAL. Open circuit: sleep until the
+    # backoff expires, then the first batch doubles as the probe. A
+    # successful probe closes the circuit and the drain carries on at once.
+    # Held runs are snapshotted, and the traffic capture flushed, at least
+    # every FLUSH_INTERVAL meanwhile.
+    # Every probe either closes the circuit or reschedules it, so a due probe
+    # only finds the circuit still open when there was nothing to send; then
+    # the loop waits for work like a closed one instead of spinning.
+    while True:
+        delay = breaker.retry_delay() if breaker.is_open() else FLUSH_INTERVAL
+        flush_wakeup.wait(min(delay, FLUSH_INTERVAL) or FLUSH_INTERVAL)
+        flush_wakeup.clear()
+        coalescer.save()
+        if capture is not None:
+            capture.flush()
+        if not queue_depth() or breaker.retry_delay() > 0:
+            continue
+        drain_queue()
+
+def send_worker():
+    while True:
+        payload, mid = channel.get()
+        if breaker.is_open() or not try_send(payload):
+            enqueue(payload, mid)
+        else:
+            ack(mid)
+
+def spill_channel():
+    """Move anything still waiting in the channel to the durable queue."""
     while True:
-        time.sleep(FLUSH_INTERVAL)
-        with queue_lock:
-            if not queue:
-                continue
-            remaining = []
-            for item in queue:
-                if not try_send(item):
-                    remaining.append(item)
-            queue.clear()
-            queue.extend(remaining)
-            persist_queue()
-        logger.info("Flush complete (remaining=%d)", len(queue))
+        try:
+            payload, mid = channel.get_nowait()
+        except queue.Empty:
+            break
+        enqueue(payload, mid)
+    coalescer.seal(backlog)
+    backlog.sync()
+
+class EventLane:
+    """Priority forwarding of elevator events (errors, alarms).
+
+    Events never share the telemetry path: they have their own sender
+    thread, durable queue (EVENTS_QUEUE_DIR) and circuit breaker with a
+    short retry cap, so however large the telemetry backlog is, an event
+    waits at most for the events API itself. Every event is appended to the
+    queue (and fsynced) before it is sent, and the queue is sent in order.
+    """
+
+    def __init__(self, url, directory):
+        self.url = url
+        self.log = SegmentedLog(directory)
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, RETRY_BASE_DELAY, EVENTS_RETRY_MAX_DELAY,
+                                      name="events API")
+        self.inbox = queue.Queue()
+        logger.info("Opened events queue %s (%d unacked events)", directory, len(self.log))
+
+    def __len__(self):
+        return len(self.log) + self.inbox.qsize()
+
+    def submit(self, event, mid=None):
+        self.inbox.put((event, time.monotonic(), mid))
+
+    def run(self):
+        received = {}  # log offset -> monotonic receive time, for the histogram
+        mids = []  # broker messages to acknowledge once their events are synced
+        while True:
+            if not len(self.log):
+                timeout = None
+            elif self.breaker.is_open():
+                timeout = self.breaker.retry_delay()
+            else:
+                timeout = RETRY_BASE_DELAY
+            try:
+                item = self.inbox.get(timeout=timeout)
+                while True:
+                    event, at, mid = item
+                    received[self.log.append(event)] = at
+                    if mid is not None:
+                        mids.append(mid)
+                    item = self.inbox.get_nowait()
+            except queue.Empty:
+                pass
+            self.log.sync()
+            for mid in mids:
+                ack(mid)
+            mids.clear()
+            if self.breaker.retry_delay() == 0:
+                self.drain(received)
+
+    def drain(self, received):
+        while True:
+            entries = self.log.read(100)
+            if not entries:
+                return
+            for cursor, event in entries:
+                if not self.send(event):
+                    return
+                self.log.commit(cursor)
+                at = received.pop(cursor.offset - 1, None)
+                if at is not None:
+                    event_delivery_seconds.observe(time.monotonic() - at)
+
+    def send(self, event):
+        """POST one event; return False if it should be retried."""
+        try:
+            with event_send_seconds.time():
+                resp = post(self.url, event, timeout=2)
+        except requests.RequestException as e:
+            log_limited(logging.WARNING, "Events API request failed: %s", e)
+            self.breaker.record_failure()
+            return False
+        if resp.status_code == 200:
+            events_forwarded_total.inc()
+            self.breaker.record_success()
+            logger.info("Forwarded %s event to API", event.get("type"))
+            return True
+        if is_rejection(resp.status_code):
+            dead_letter(event, rejection_reason(resp))
+            return True
+        log_limited(logging.WARNING, "Events API returned %s", resp.status_code)
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        return False
+
+    def close(self):
+        """Queue anything not yet appended and close the queue."""
+        while True:
+            try:
+                event, _, _ = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            self.log.append(event)
+        self.log.close()
+
+# last full reading per elevator, used to expand delta-only readings
+last_readings = {}
+# Passthrough readings are not parsed, so their elevator is unknown: in
+# that mode a delta is expanded against the last full reading on its topic
+# (raw bytes until a delta needs them decoded), if it is of that elevator.
+last_on_topic = {}
+
+def expand_delta(delta, topic):
+    """Return the full reading for a delta-only reading (``"delta": true``
+    plus the changed fields), or None if no full reading of that elevator
+    has been seen yet."""
+    key = delta.get("elevator_id")
+    if not isinstance(key, (int, str, type(None))):
+        return None
+    if PASSTHROUGH:
+        base = last_on_topic.get(topic)
+        if isinstance(base, bytes):
+            try:
+                base = last_on_topic[topic] = json.loads(base)
+            except ValueError:
+                base = None
+        if not isinstance(base, dict) or base.get("elevator_id") != key:
+            return None
+    else:
+        base = last_readings.get(key)
+    if base is None:
+        return None
+    reading = dict(base)
+    reading.update((k, v) for k, v in delta.items() if k != "delta")
+    return reading
+
+def is_passthrough(data):
+    """Cheap structural check for passthrough: one line, braces at both
+    ends, no delta.
+
+    Anything else takes the parsing path, so deltas are expanded and queue
+    lines stay one record each. Malformed JSON that passes is refused by the
+    API with a 400 and dead-lettered from there.
+    """
+    return data[:1] == b"{" and data[-1:] == b"}" and b"\n" not in data and b'"delta"' not in data
 
 def on_message(client, userdata, message):
+    # Runs on the paho network loop: never block here on the API. The
+    # payload is handed to the sender pool, or spilled to the durable queue
+    # when the senders can't keep up.
+    # Under DURABLE_INTAKE the message is acknowledged to the broker only once
+    # it is forwarded, queued on disk or dead-lettered.
+    received_total.inc()
+    if capture is not None:
+        capture.write(time.time(), message.topic, message.payload)
+    mid = message.mid if DURABLE_INTAKE and message.qos else None
+    if is_event_topic(message.topic):
+        on_event(message, mid)
+        return
+    if PASSTHROUGH and is_passthrough(message.payload):
+        payload = last_on_topic[message.topic] = message.payload
+    else:
+        payload = parse_reading(message)
+        if payload is None:
+            ack(mid)
+            return
     try:
-        payload = json.loads(message.payload.decode())
-    except json.JSONDecodeError:
-        logger.warning("Invalid JSON received on %s", message.topic)
+        channel.put_nowait((payload, mid))
+    except queue.Full:
+        enqueue(payload, mid)
+
+def is_event_topic(topic):
+    return topic == TOPIC_EVENTS or mqtt.topic_matches_sub(TOPIC_FLEET_EVENTS, topic)
+
+def on_event(message, mid):
+    try:
+        event = json.loads(message.payload.decode())
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        invalid_total.inc()
+        dead_letter(message.payload.decode(errors="replace"), f"Invalid JSON on {message.topic}")
+        ack(mid)
         return
-    if not try_send(payload):
-        enqueue(payload)
+    error = validate_event(event)
+    if error:
+        invalid_total.inc()
+        dead_letter(event, f"{error} on {message.topic}")
+        ack(mid)
+        return
+    events.submit(event, mid)
+
+def parse_reading(message):
+    """Decode, expand and validate a reading; None if it was dead-lettered."""
+    try:
+        payload = json.loads(message.payload.decode())
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        invalid_total.inc()
+        dead_letter(message.payload.decode(errors="replace"), f"Invalid JSON on {message.topic}")
+        return None
+    if isinstance(payload, dict) and payload.get("delta") is True:
+        if SHARE_GROUP:
+            # the other workers of the group see the rest of this elevator's
+            # readings, so last_readings may be stale: refuse, don't guess
+            invalid_total.inc()
+            dead_letter(payload, f"Delta on a shared subscription ({SHARE_GROUP}) on {message.topic}")
+            return None
+        full = expand_delta(payload, message.topic)
+        if full is None:
+            invalid_total.inc()
+            dead_letter(payload, f"Delta with no earlier full reading on {message.topic}")
+            return None
+        payload = full
+    error = validate_reading(payload)
+    if error:
+        invalid_total.inc()
+        dead_letter(payload, f"{error} on {message.topic}")
+        return None
+    if PASSTHROUGH:
+        last_on_topic[message.topic] = payload
+    else:
+        key = payload.get("elevator_id")
+        if isinstance(key, (int, str, type(None))):
+            last_readings[key] = payload
+    return payload
+
+def subscription(topic):
+    return f"$share/{SHARE_GROUP}/{topic}" if SHARE_GROUP else topic
 
 def main():
+    global events, mqtt_client, capture
     load_queue()
+    if CAPTURE_FILE:
+        capture = CaptureWriter(CAPTURE_FILE)
+        logger.info("Capturing MQTT traffic to %s", CAPTURE_FILE)
+    events = EventLane(EVENTS_API_URL, EVENTS_QUEUE_DIR)
+    threading.Thread(target=events.run, name="events", daemon=True).start()
+    if METRICS_PORT:
+        start_metrics_server(metrics, METRICS_HOST, METRICS_PORT, health)
     t = threading.Thread(target=flush_queue, daemon=True)
     t.start()
+    for i in range(SENDER_WORKERS):
+        threading.Thread(target=send_worker, name=f"sender-{i}", daemon=True).start()
 
-    client = mqtt.Client()
+    # SIGTERM unwinds through the finally below so queued work is persisted.
+    # (Signal handlers can only be set from the main thread; the in-process
+    # test mode runs the bridge on a worker thread.)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    client = mqtt_client = mqtt.Client(
+        client_id=MQTT_CLIENT_ID, clean_session=not DURABLE_INTAKE, manual_ack=DURABLE_INTAKE
+    )
+    topics = [subscription(t) for t in (TOPIC_DATA, TOPIC_FLEET_DATA, TOPIC_EVENTS, TOPIC_FLEET_EVENTS)]
+    qos = 1 if DURABLE_INTAKE else 0
+
+    def on_connect(client, userdata, flags, rc):
+        # (re)subscribe on every connect: loop_forever reconnects after a
+        # broker restart, and a clean session starts with no subscriptions
+        if rc != 0:
+            logger.warning("MQTT connect to %s:%s refused (rc=%s)", BROKER, PORT, rc)
+            return
+        client.subscribe([(topic, qos) for topic in topics])
+        logger.info("Bridge connected to MQTT %s:%s as %r, subscribed to %s at QoS %d%s", BROKER, PORT,
+                    MQTT_CLIENT_ID, ", ".join(topics), qos, " (durable intake)" if DURABLE_INTAKE else "")
+
+    client.on_connect = on_connect
     client.on_message = on_message
     client.connect(BROKER, PORT)
-    client.subscribe(TOPIC_DATA)
-    logger.info("Bridge connected to MQTT %s:%s, subscribed to %s", BROKER, PORT, TOPIC_DATA)
-    client.loop_forever()
+    try:
+        client.loop_forever()
+    finally:
+        client.disconnect()
+        spill_channel()
+        backlog.close()
+        events.close()
+        if capture is not None:
+            capture.close()
 
 if __name__ == "__main__":
+    # basic logging to stdout (captured by environment.py); configured only
+    # here so that importing the bridge leaves the root logger alone
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s [{LOG_NAME}] %(levelname)s: %(message)s"
+    )
     logger.info("Starting bridge")
     main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""Run several bridge workers that share one MQTT subscription group.
+
+Each worker is a ``bridge.py`` process subscribed through
+``$share/<SHARE_GROUP>/...``, so the broker spreads the sensor messages
+across them. Every worker owns its own queue shard (``QUEUE_DIR/worker-<n>``),
+sender pool and metrics port; a worker that dies is restarted on the same
+shard with exponential backoff, so its backlog is picked up again and never
+touched by another worker.
+
+The supervisor serves ``/healthz`` (per-worker status plus totals) and its
+own ``/metrics`` on ``METRICS_PORT``; worker ``n`` serves its metrics on
+``METRICS_PORT + 1 + n``.
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from metrics import Registry, start_metrics_server
+
+BRIDGE_WORKERS = int(os.getenv("BRIDGE_WORKERS", str(os.cpu_count() or 1)))
+SHARE_GROUP = os.getenv("SHARE_GROUP", "bridge")
+QUEUE_DIR = os.getenv("QUEUE_DIR", "bridge_queue")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL", "2.0"))
+RESTART_BASE_DELAY = float(os.getenv("RESTART_BASE_DELAY", "1.0"))
+RESTART_MAX_DELAY = float(os.getenv("RESTART_MAX_DELAY", "30.0"))
+# a worker that stayed up this long gets its restart backoff reset
+RESTART_RESET_AFTER = float(os.getenv("RESTART_RESET_AFTER", "30.0"))
+# each worker records its own traffic to CAPTURE_FILE with the worker index
+# added to the name (incident.evcap -> incident.worker-0.evcap)
+CAPTURE_FILE = os.getenv("CAPTURE_FILE")
+
+# delta-only readings (the simulator's DELTA_ONLY) can only be expanded by a
+# bridge that sees every reading of an elevator, which shared workers don't
+DELTA_ONLY = os.getenv("DELTA_ONLY", "").lower() in ("1", "true", "yes")
+
+BRIDGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bridge.py")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [supervisor] %(levelname)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+metrics = Registry()
+restarts_total = metrics.counter("bridge_worker_restarts_total", "Bridge worker restarts")
+
+
+class Worker:
+    """One bridge process and its restart bookkeeping."""
+
+    def __init__(self, index):
+        self.index = index
+        self.queue_dir = os.path.join(QUEUE_DIR, f"worker-{index}")
+        self.metrics_port = METRICS_PORT + 1 + index if METRICS_PORT else 0
+        self.proc = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.restart_at = 0.0
+        self.health = None
+
+    def start(self):
+        env = os.environ.copy()
+        env.update({
+            "SHARE_GROUP": SHARE_GROUP,
+            "QUEUE_DIR": self.queue_dir,
+            "METRICS_PORT": str(self.metrics_port),
+            "MQTT_CLIENT_ID": f"{SHARE_GROUP}-worker-{self.index}",
+            "LOG_NAME": f"bridge-{self.index}",
+        })
+        if CAPTURE_FILE:
+            base, ext = os.path.splitext(CAPTURE_FILE)
+            env["CAPTURE_FILE"] = f"{base}.worker-{self.index}{ext}"
+        self.proc = subprocess.Popen([sys.executable, "-u", BRIDGE], env=env)
+        self.started_at = time.monotonic()
+        logger.info("Started worker %d (pid %d, queue %s)", self.index, self.proc.pid, self.queue_dir)
+
+    def check(self):
+        """Restart the worker if it exited and its backoff has expired."""
+        if self.proc is not None:
+            code = self.proc.poll()
+            if code is None:
+                if time.monotonic() - self.started_at >= RESTART_RESET_AFTER:
+                    self.failures = 0
+                return
+            self.failures += 1
+            delay = min(RESTART_MAX_DELAY, RESTART_BASE_DELAY * 2 ** (self.failures - 1))
+            self.restart_at = time.monotonic() + delay
+            self.proc = None
+            self.health = None
+            logger.warning("Worker %d exited with %s, restarting in %.1fs", self.index, code, delay)
+        if time.monotonic() >= self.restart_at:
+            self.restarts += 1
+            restarts_total.inc()
+            self.start()
+
+    def poll_health(self):
+        if self.proc is None or not self.metrics_port:
+            self.health = None
+            return
+        try:
+            resp = requests.get(f"http://127.0.0.1:{self.metrics_port}/healthz", timeout=1)
+            self.health = resp.json()
+        except (requests.RequestException, ValueError):
+            self.health = None
+
+    def status(self):
+        return {
+            "worker": self.index,
+            "pid": self.proc.pid if self.proc is not None else None,
+            "running": self.proc is not None,
+            "restarts": self.restarts,
+            "health": self.health,
+        }
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGTERM)
+
+    def wait(self, timeout):
+        if self.proc is None:
+            return
+        try:
+            self.proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("Worker %d did not stop, killing it", self.index)
+            self.proc.kill()
+
+
+def health(workers):
+    statuses = [w.status() for w in workers]
+    healthy = [s for s in statuses if s["health"] is not None]
+    return {
+        "status": "ok" if len(healthy) == len(workers) else "degraded",
+        "workers": statuses,
+        "queue_depth": sum(s["health"]["queue_depth"] for s in healthy),
+        "events_queue_depth": sum(s["health"]["events_queue_depth"] for s in healthy),
+        "forwarded": sum(s["health"]["forwarded"] for s in healthy),
+    }
+
+
+def main():
+    if DELTA_ONLY:
+        logger.error("DELTA_ONLY is set: delta readings need a single bridge, not shared workers")
+        sys.exit(2)
+    workers = [Worker(i) for i in range(BRIDGE_WORKERS)]
+    metrics.gauge("bridge_workers_running", "Bridge workers currently running",
+                  lambda: sum(w.proc is not None for w in workers))
+    metrics.gauge("bridge_workers_healthy", "Bridge workers answering /healthz",
+                  lambda: sum(w.health is not None for w in workers))
+    if METRICS_PORT:
+        start_metrics_server(metrics, METRICS_HOST, METRICS_PORT, lambda: health(workers))
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    for w in workers:
+        w.start()
+    logger.info("Supervising %d bridge workers in share group %s", len(workers), SHARE_GROUP)
+    while not stopping.wait(HEALTH_INTERVAL):
+        for w in workers:
+            w.check()
+            w.poll_health()
+
+    logger.info("Stopping workers")
+    for w in workers:
+        w.stop()
+    for w in workers:
+        w.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
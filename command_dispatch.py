@@ -0,0 +1,184 @@
+"""Cloud-to-elevator command dispatch for the mock cloud API.
+
+Commands are published over one persistent MQTT connection at QoS 1 as
+``{"command": ..., "correlation_id": ...}``. The simulator answers each of
+them with an ack on ``elevator/acks`` (``elevator/<id>/acks`` in fleet
+mode) carrying the same correlation id, which completes the command and
+records its round-trip time.
+
+The connection is opened on first use, so the API still starts without a
+broker.
+"""
+import collections
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+BROKER = os.getenv("MQTT_BROKER", "localhost")
+PORT = int(os.getenv("MQTT_PORT", "1883"))
+TOPIC_PREFIX = os.getenv("TOPIC_PREFIX", "")
+TOPIC_COMMAND = TOPIC_PREFIX + "elevator/command"
+TOPIC_ACKS = TOPIC_PREFIX + "elevator/acks"
+FLEET_TOPIC = TOPIC_PREFIX + "elevator/{}/{}"
+# completed commands kept for lookup, and round-trip samples kept for the
+# percentiles
+COMMAND_HISTORY = int(os.getenv("COMMAND_HISTORY", "10000"))
+RTT_SAMPLES = int(os.getenv("RTT_SAMPLES", "10000"))
+
+
+def set_nodelay(client, userdata, sock):
+    # commands and acks are a few dozen bytes each: without TCP_NODELAY,
+    # Nagle's algorithm holds one back until the previous one is ACKed,
+    # which costs a delayed-ACK timeout (~40 ms) per round trip
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+class _Command:
+    __slots__ = ("correlation_id", "command", "elevator_id", "sent_at", "sent_ts",
+                 "status", "error", "rtt", "done")
+
+    def __init__(self, correlation_id, command, elevator_id):
+        self.correlation_id = correlation_id
+        self.command = command
+        self.elevator_id = elevator_id
+        self.sent_at = time.monotonic()
+        self.sent_ts = time.time()
+        self.status = "pending"
+        self.error = None
+        self.rtt = None
+        self.done = threading.Event()
+
+    def as_dict(self):
+        result = {
+            "correlation_id": self.correlation_id,
+            "command": self.command,
+            "status": self.status,
+            "sent_ts": self.sent_ts,
+        }
+        if self.elevator_id is not None:
+            result["elevator_id"] = self.elevator_id
+        if self.error is not None:
+            result["error"] = self.error
+        if self.rtt is not None:
+            result["rtt_ms"] = self.rtt * 1000
+        return result
+
+
+class CommandDispatcher:
+    """Publishes commands and matches the simulator's acks to them."""
+
+    def __init__(self, host=BROKER, port=PORT):
+        self.host = host
+        self.port = port
+        self._client = None
+        self._connect_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._commands = collections.OrderedDict()  # correlation id -> _Command
+        self._rtts = collections.deque(maxlen=RTT_SAMPLES)
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+
+    def _connection(self):
+        with self._connect_lock:
+            if self._client is None:
+                subscribed = threading.Event()
+                client = mqtt.Client(client_id=f"command-dispatch-{uuid.uuid4().hex[:8]}")
+                client.on_message = self._on_ack
+                client.on_socket_open = set_nodelay
+                client.on_subscribe = lambda *args: subscribed.set()
+                client.on_connect = self._on_connect
+                client.connect(self.host, self.port)
+                client.loop_start()
+                # acks published before the subscription is in place would be lost
+                if not subscribed.wait(5):
+                    client.loop_stop()
+                    raise ConnectionError("no SUBACK for the ack topics")
+                self._client = client
+            return self._client
+
+    @staticmethod
+    def _on_connect(client, userdata, flags, rc):
+        # subscribe on every (re)connect: the session is clean, so the
+        # subscription is gone after the loop reconnects
+        if rc == 0:
+            client.subscribe([(TOPIC_ACKS, 1), (FLEET_TOPIC.format("+", "acks"), 1)])
+
+    def dispatch(self, command, elevator_id=None):
+        """Publish ``command`` (to one fleet elevator if ``elevator_id`` is
+        given) and return its tracking record."""
+        client = self._connection()
+        cmd = _Command(uuid.uuid4().hex, command, elevator_id)
+        with self._lock:
+            self._commands[cmd.correlation_id] = cmd
+            while len(self._commands) > COMMAND_HISTORY:
+                self._commands.popitem(last=False)
+            self.sent += 1
+        topic = TOPIC_COMMAND if elevator_id is None else FLEET_TOPIC.format(elevator_id, "command")
+        payload = json.dumps({"command": command, "correlation_id": cmd.correlation_id})
+        client.publish(topic, payload, qos=1)
+        return cmd
+
+    def _on_ack(self, client, userdata, message):
+        received = time.monotonic()
+        try:
+            ack = json.loads(message.payload)
+            correlation_id = ack["correlation_id"]
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._lock:
+            cmd = self._commands.get(correlation_id)
+            if cmd is None or cmd.done.is_set():
+                return
+            cmd.rtt = received - cmd.sent_at
+            cmd.status = "ok" if ack.get("status") == "ok" else "error"
+            cmd.error = ack.get("error")
+            self._rtts.append(cmd.rtt)
+            if cmd.status == "ok":
+                self.acked += 1
+            else:
+                self.failed += 1
+        cmd.done.set()
+
+    def get(self, correlation_id):
+        with self._lock:
+            return self._commands.get(correlation_id)
+
+    @staticmethod
+    def wait(commands, timeout):
+        """Wait until every command is acked or ``timeout`` seconds pass."""
+        deadline = time.monotonic() + timeout
+        for cmd in commands:
+            if not cmd.done.wait(max(0.0, deadline - time.monotonic())):
+                return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            rtts = sorted(self._rtts)
+            pending = sum(1 for cmd in self._commands.values() if not cmd.done.is_set())
+            result = {"sent": self.sent, "acked": self.acked, "failed": self.failed, "pending": pending}
+
+        def ms(value):
+            return None if value is None else value * 1000
+
+        result["rtt_ms"] = {
+            "samples": len(rtts),
+            "p50": ms(percentile(rtts, 50)),
+            "p90": ms(percentile(rtts, 90)),
+            "p99": ms(percentile(rtts, 99)),
+            "max": ms(rtts[-1] if rtts else None),
+        }
+        return result
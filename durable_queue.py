@@ -0,0 +1,608 @@
+"""Append-only, segmented on-disk log used as the bridge's offline queue.
+
+Records are appended to numbered segment files (``<base offset>.<fmt>``) and
+never rewritten. A small ``committed`` file records the cursor of the first
+record that has not been acknowledged yet, so a restart only replays the
+unacked tail. Segments that lie entirely before the committed cursor are
+deleted by a background thread, which also fsyncs appended records in
+batches.
+
+Two segment formats exist:
+
+* ``.bin`` — a versioned header followed by fixed-width records for the
+  sensor schema (position, door_status, weight, maintenance_mode, an
+  optional elevator_id and seq, and the run length of a coalesced reading). Record N of a segment lives at a computed offset,
+  so opening, counting and seeking never parse anything, and reads iterate
+  a memory-mapped view without building intermediate objects.
+* ``.log`` — one JSON object per line, used for payloads the binary layout
+  cannot represent (and for everything when ``QUEUE_FORMAT=jsonl``).
+  Payloads appended as already-serialized JSON bytes are spliced into the
+  line unchanged and can be read back the same way, without parsing.
+
+When the format needed by the next record differs from the active
+segment's, a new segment is started.
+
+An open log holds an exclusive lock on its directory, so two processes
+can never write (or compact) the same queue.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+SEGMENT_RECORDS = int(os.getenv("SEGMENT_RECORDS", "10000"))
+FSYNC_BATCH = int(os.getenv("FSYNC_BATCH", "64"))
+FSYNC_INTERVAL = float(os.getenv("FSYNC_INTERVAL", "0.5"))
+QUEUE_FORMAT = os.getenv("QUEUE_FORMAT", "binary")
+
+JSON_SUFFIX = ".log"
+BINARY_SUFFIX = ".bin"
+COMMIT_FILE = "committed"
+LOCK_FILE = "lock"
+
+# Binary segment header: magic, format version, record size.
+BINARY_MAGIC = b"EVQB"
+BINARY_HEADER = struct.Struct("<4sHH")
+BINARY_VERSION = 3
+BINARY_RECORDS = {
+    # ts, elevator_id, weight, position, flags
+    1: struct.Struct("<dIHBB"),
+    # ts (first reading of a run), last_ts, elevator_id, count, weight,
+    # position, flags
+    2: struct.Struct("<ddIIHBB4x"),
+    # ts, last_ts, seq, elevator_id, count, weight, position, flags
+    3: struct.Struct("<ddQIIHBB4x"),
+}
+BINARY_RECORD = BINARY_RECORDS[BINARY_VERSION]
+FLAG_DOOR_OPEN = 0x01
+FLAG_MAINTENANCE = 0x02
+FLAG_HAS_MAINTENANCE = 0x04
+FLAG_HAS_ELEVATOR_ID = 0x08
+FLAG_HAS_SEQ = 0x10
+BINARY_KEYS = {"position", "door_status", "weight", "maintenance_mode", "elevator_id", "seq", "coalesced"}
+
+# offset: log offset of the next record to read; segment: base offset of the
+# segment holding it; position: byte position of that record in the segment.
+Cursor = namedtuple("Cursor", ["offset", "segment", "position"])
+
+
+def _segment_name(base, suffix):
+    return "%020d%s" % (base, suffix)
+
+
+def _list_segments(directory):
+    """Return ``{base offset: suffix}`` for the segments in ``directory``."""
+    segments = {}
+    for name in os.listdir(directory):
+        base, suffix = os.path.splitext(name)
+        if suffix in (JSON_SUFFIX, BINARY_SUFFIX) and base.isdigit():
+            segments[int(base)] = suffix
+    return segments
+
+
+def _read_commit(directory):
+    """Return the committed cursor, or None if there is none or it is
+    unreadable (the log then replays from its first segment)."""
+    path = os.path.join(directory, COMMIT_FILE)
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        return Cursor(data["offset"], data["segment"], data["position"])
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError):
+        # torn by a crash on a filesystem that reordered the rename: replaying
+        # acknowledged records beats refusing to start
+        return None
+
+
+def _fsync_dir(directory):
+    """Make a rename in ``directory`` durable (no-op where unsupported)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def pending_count(directory):
+    """Count unacked records in the log at ``directory`` without opening it.
+
+    Used by the test steps, which run in a different process than the bridge.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    segments = _list_segments(directory)
+    committed = _read_commit(directory)
+    count = 0
+    for base in sorted(segments):
+        if committed is not None and base < committed.segment:
+            continue
+        path = os.path.join(directory, _segment_name(base, segments[base]))
+        try:
+            if segments[base] == BINARY_SUFFIX:
+                record = _binary_record(path)
+                records = max(0, os.path.getsize(path) - BINARY_HEADER.size) // record.size
+                if committed is not None and base == committed.segment:
+                    records -= committed.offset - base
+                count += max(0, records)
+                continue
+            with open(path, "rb") as f:
+                if committed is not None and base == committed.segment:
+                    f.seek(committed.position)
+                count += sum(1 for line in f if line.endswith(b"\n"))
+        except FileNotFoundError:
+            continue
+    return count
+
+
+def _binary_record(path):
+    """Return the record struct declared by the header of a ``.bin`` segment."""
+    with open(path, "rb") as f:
+        header = f.read(BINARY_HEADER.size)
+    if len(header) < BINARY_HEADER.size:
+        return BINARY_RECORD
+    magic, version, record_size = BINARY_HEADER.unpack(header)
+    record = BINARY_RECORDS.get(version)
+    if magic != BINARY_MAGIC or record is None or record.size != record_size:
+        raise ValueError(
+            f"{path}: unsupported queue segment "
+            f"(magic={magic!r}, version={version}, record size={record_size})"
+        )
+    return record
+
+
+def _slice_json(line):
+    """Return ``(enqueue ts, payload bytes)`` cut out of a
+    ``{"ts":...,"payload":...}`` line, or None for other lines."""
+    if not line.startswith(b'{"ts":') or not line.endswith(b"}\n"):
+        return None
+    end = line.find(b',"payload":')
+    if end < 0:
+        return None
+    try:
+        return float(line[6:end]), line[end + 11:-2]
+    except ValueError:
+        return None
+
+
+def _decode_json(line):
+    """Return ``(enqueue ts, payload)`` for one JSON record line."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        # raw bytes appended as they came, but not valid JSON after all:
+        # hand them back as text for the caller to reject
+        sliced = _slice_json(line)
+        if sliced is None:
+            return None, line.decode(errors="replace").rstrip("\n")
+        return sliced[0], sliced[1].decode(errors="replace")
+    if isinstance(record, dict) and record.keys() == {"ts", "payload"}:
+        return record["ts"], record["payload"]
+    # segments written before records carried a timestamp hold bare payloads
+    return None, record
+
+
+def _raw_json(line):
+    """Return ``(enqueue ts, payload JSON bytes)`` for one JSON record line."""
+    sliced = _slice_json(line)
+    if sliced is not None:
+        return sliced
+    ts, payload = _decode_json(line)
+    return ts, json.dumps(payload, separators=(",", ":")).encode()
+
+
+def encode_binary(payload, ts):
+    """Pack ``payload`` as a fixed-width record, or return None if it does
+    not fit the sensor schema exactly."""
+    if not isinstance(payload, dict) or not payload.keys() <= BINARY_KEYS:
+        return None
+    position = payload.get("position")
+    weight = payload.get("weight")
+    door = payload.get("door_status")
+    if type(position) is not int or not 0 <= position <= 0xFF:
+        return None
+    if type(weight) is not int or not 0 <= weight <= 0xFFFF:
+        return None
+    if door not in ("open", "closed"):
+        return None
+    flags = FLAG_DOOR_OPEN if door == "open" else 0
+    if "maintenance_mode" in payload:
+        if type(payload["maintenance_mode"]) is not bool:
+            return None
+        flags |= FLAG_HAS_MAINTENANCE
+        if payload["maintenance_mode"]:
+            flags |= FLAG_MAINTENANCE
+    elevator_id = 0
+    if "elevator_id" in payload:
+        elevator_id = payload["elevator_id"]
+        if type(elevator_id) is not int or not 0 <= elevator_id <= 0xFFFFFFFF:
+            return None
+        flags |= FLAG_HAS_ELEVATOR_ID
+    seq = 0
+    if "seq" in payload:
+        seq = payload["seq"]
+        if type(seq) is not int or not 0 <= seq <= 0xFFFFFFFFFFFFFFFF:
+            return None
+        flags |= FLAG_HAS_SEQ
+    count, last_ts = 1, ts
+    if "coalesced" in payload:
+        # a run is stored with its first reading's time as the record time
+        run = payload["coalesced"]
+        if not isinstance(run, dict) or run.keys() != {"count", "first_ts", "last_ts"}:
+            return None
+        count, first_ts, last_ts = run["count"], run["first_ts"], run["last_ts"]
+        if type(count) is not int or not 1 < count <= 0xFFFFFFFF:
+            return None
+        if type(first_ts) is not float or type(last_ts) is not float or first_ts != ts:
+            return None
+    return BINARY_RECORD.pack(ts, last_ts, seq, elevator_id, count, weight, position, flags)
+
+
+def decode_binary(fields):
+    """Rebuild the payload dict from an unpacked binary record (any version)."""
+    if len(fields) == 5:
+        ts, elevator_id, weight, position, flags = fields
+        last_ts, count, seq = ts, 1, 0
+    elif len(fields) == 7:
+        ts, last_ts, elevator_id, count, weight, position, flags = fields
+        seq = 0
+    else:
+        ts, last_ts, seq, elevator_id, count, weight, position, flags = fields
+    payload = {
+        "position": position,
+        "door_status": "open" if flags & FLAG_DOOR_OPEN else "closed",
+        "weight": weight,
+    }
+    if flags & FLAG_HAS_MAINTENANCE:
+        payload["maintenance_mode"] = bool(flags & FLAG_MAINTENANCE)
+    if flags & FLAG_HAS_ELEVATOR_ID:
+        payload["elevator_id"] = elevator_id
+    if flags & FLAG_HAS_SEQ:
+        payload["seq"] = seq
+    if count > 1:
+        payload["coalesced"] = {"count": count, "first_ts": ts, "last_ts": last_ts}
+    return payload
+
+
+class SegmentedLog:
+    """Durable FIFO of sensor readings with O(1) append and commit."""
+
+    def __init__(self, directory, segment_records=SEGMENT_RECORDS,
+                 fsync_batch=FSYNC_BATCH, fsync_interval=FSYNC_INTERVAL,
+                 fmt=QUEUE_FORMAT):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.binary = fmt == "binary"
+        os.makedirs(directory, exist_ok=True)
+        self._dir_lock = open(os.path.join(directory, LOCK_FILE), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._dir_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._dir_lock.close()
+                raise RuntimeError(f"queue {directory} is already open in another process")
+
+        self._lock = threading.Lock()
+        self._segments = []
+        self._suffixes = {}
+        self._records = {}
+        self._writer = None
+        self._active_count = 0
+        self._next_offset = 0
+        self._committed = Cursor(0, 0, 0)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._closed = False
+        self._head_ts = None
+        self._wakeup = threading.Event()
+        self._recover()
+
+        self._maintenance = threading.Thread(target=self._maintain, name="queue-maintenance", daemon=True)
+        self._maintenance.start()
+
+    def __len__(self):
+        return self._next_offset - self._committed.offset
+
+    # -- recovery ----------------------------------------------------------
+
+    def _recover(self):
+        self._suffixes = _list_segments(self.directory)
+        if not self._suffixes:
+            self._suffixes = {0: BINARY_SUFFIX if self.binary else JSON_SUFFIX}
+        self._segments = sorted(self._suffixes)
+        active = self._segments[-1]
+        path = self._path(active)
+        for base, suffix in self._suffixes.items():
+            if suffix == BINARY_SUFFIX and os.path.exists(self._path(base)):
+                self._records[base] = _binary_record(self._path(base))
+
+        # Count the records of the active segment and cut off a torn write
+        # left behind by a crash in the middle of an append.
+        if self._suffixes[active] == BINARY_SUFFIX:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < BINARY_HEADER.size:
+                with open(path, "wb") as f:
+                    f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_RECORD.size))
+                self._records[active] = BINARY_RECORD
+            record = self._records[active]
+            count = max(0, size - BINARY_HEADER.size) // record.size
+            valid = BINARY_HEADER.size + count * record.size
+            if size > BINARY_HEADER.size and valid != size:
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+        else:
+            count = 0
+            valid = 0
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break
+                        count += 1
+                        valid += len(line)
+                if valid != os.path.getsize(path):
+                    with open(path, "r+b") as f:
+                        f.truncate(valid)
+        self._active_count = count
+        self._next_offset = active + count
+        self._writer = open(path, "ab")
+
+        committed = _read_commit(self.directory)
+        if committed is None or committed.segment not in self._suffixes:
+            first = self._segments[0]
+            committed = Cursor(first, first, self._start_position(first))
+        self._committed = self._normalize(committed)
+        self._compact()
+
+    # -- writing -----------------------------------------------------------
+
+    def append(self, payload, ts=None):
+        """Append ``payload`` and return its offset.
+
+        ``ts`` is the record time reported by :meth:`oldest_timestamp`; it
+        defaults to now. ``payload`` may also be the JSON bytes of an object
+        (on a single line), which are stored without being parsed.
+        """
+        if ts is None:
+            ts = time.time()
+        data = encode_binary(payload, ts) if self.binary else None
+        if data is not None:
+            suffix = BINARY_SUFFIX
+        elif isinstance(payload, bytes):
+            suffix = JSON_SUFFIX
+            data = b'{"ts":%s,"payload":%s}\n' % (repr(float(ts)).encode(), payload)
+        else:
+            suffix = JSON_SUFFIX
+            record = {"ts": ts, "payload": payload}
+            data = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            writable = self._writable(suffix)
+            if self._active_count >= self.segment_records or (not writable and self._active_count):
+                self._roll(suffix)
+            elif not writable:
+                self._reformat_empty(suffix)
+            self._writer.write(data)
+            offset = self._next_offset
+            self._next_offset += 1
+            self._active_count += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_batch:
+                self._sync_locked()
+        return offset
+
+    def _writable(self, suffix):
+        # True if records of this format can go to the active segment (binary
+        # segments from an older version are only ever read)
+        active = self._segments[-1]
+        if self._suffixes[active] != suffix:
+            return False
+        return suffix != BINARY_SUFFIX or self._records[active] is BINARY_RECORD
+
+    def _open_segment(self, base, suffix):
+        self._suffixes[base] = suffix
+        self._writer = open(self._path(base), "ab")
+        if suffix == BINARY_SUFFIX:
+            self._records[base] = BINARY_RECORD
+            self._writer.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_RECORD.size))
+
+    def _roll(self, suffix):
+        self._sync_locked()
+        self._writer.close()
+        base = self._next_offset
+        self._segments.append(base)
+        self._open_segment(base, suffix)
+        self._active_count = 0
+
+    def _reformat_empty(self, suffix):
+        # The active segment has no records yet: replace it with an empty
+        # segment of the wanted format instead of leaving an empty file.
+        base = self._segments[-1]
+        self._writer.close()
+        os.remove(self._path(base))
+        self._records.pop(base, None)
+        self._open_segment(base, suffix)
+        if self._committed.segment == base:
+            self._committed = Cursor(base, base, self._start_position(base))
+
+    def sync(self):
+        """Flush and fsync any records appended since the last sync."""
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._unsynced:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    # -- reading -----------------------------------------------------------
+
+    def read(self, limit, raw=False):
+        """Return up to ``limit`` unacked records as ``(cursor, payload)``.
+
+        ``cursor`` points just past its record; passing it to :meth:`commit`
+        acknowledges that record and everything before it. With ``raw`` the
+        payloads are returned as JSON bytes, sliced straight out of JSON
+        segments.
+        """
+        with self._lock:
+            self._writer.flush()
+            cursor = self._committed
+            end = self._next_offset
+            segments = list(self._segments)
+            suffixes = dict(self._suffixes)
+            records = dict(self._records)
+
+        entries = []
+        offset, segment, position = cursor
+        while len(entries) < limit and offset < end:
+            idx = segments.index(segment)
+            seg_end = segments[idx + 1] if idx + 1 < len(segments) else end
+            want = min(limit - len(entries), seg_end - offset)
+            if suffixes[segment] == BINARY_SUFFIX:
+                offset, position = self._read_binary(segment, records[segment], offset, want, entries, raw)
+            else:
+                offset, position = self._read_json(segment, offset, position, want, entries, raw)
+            if idx + 1 < len(segments) and offset >= segments[idx + 1]:
+                segment = segments[idx + 1]
+                position = self._start_position(segment, suffixes)
+            elif len(entries) < limit:
+                break
+        return entries
+
+    def _read_json(self, segment, offset, position, want, entries, raw):
+        decode = _raw_json if raw else _decode_json
+        with open(self._path(segment), "rb") as f:
+            f.seek(position)
+            for line in f:
+                if want <= 0 or not line.endswith(b"\n"):
+                    break
+                offset += 1
+                position += len(line)
+                want -= 1
+                entries.append((Cursor(offset, segment, position), decode(line)[1]))
+        return offset, position
+
+    def _read_binary(self, segment, record, offset, want, entries, raw):
+        size = record.size
+        start = BINARY_HEADER.size + (offset - segment) * size
+        with open(self._path(segment), "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            stop = min(file_size, start + want * size)
+            stop -= (stop - start) % size
+            if stop <= start:
+                return offset, start
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    position = start
+                    for fields in record.iter_unpack(view[start:stop]):
+                        offset += 1
+                        position += size
+                        payload = decode_binary(fields)
+                        if raw:
+                            payload = json.dumps(payload, separators=(",", ":")).encode()
+                        entries.append((Cursor(offset, segment, position), payload))
+                finally:
+                    view.release()
+        return offset, stop
+
+    def oldest_timestamp(self):
+        """Record time of the oldest unacked record, or None if empty."""
+        with self._lock:
+            if self._next_offset == self._committed.offset:
+                return None
+            committed = self._committed
+            if self._head_ts is not None and self._head_ts[0] == committed.offset:
+                return self._head_ts[1]
+            self._writer.flush()
+            record = self._records.get(committed.segment)
+        with open(self._path(committed.segment), "rb") as f:
+            f.seek(committed.position)
+            if record is not None:
+                ts = record.unpack(f.read(record.size))[0]
+            else:
+                ts = _decode_json(f.readline())[0]
+        self._head_ts = (committed.offset, ts)
+        return ts
+
+    def commit(self, cursor):
+        """Mark every record before ``cursor`` as acknowledged."""
+        with self._lock:
+            if cursor.offset <= self._committed.offset:
+                return
+            self._committed = self._normalize(cursor)
+            tmp = os.path.join(self.directory, COMMIT_FILE + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump(self._committed._asdict(), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(self.directory, COMMIT_FILE))
+            _fsync_dir(self.directory)
+        self._wakeup.set()
+
+    def _normalize(self, cursor):
+        # A cursor sitting at the end of a sealed segment is moved to the start
+        # of the next one so the sealed segment can be compacted away.
+        idx = self._segments.index(cursor.segment)
+        while idx + 1 < len(self._segments) and cursor.offset >= self._segments[idx + 1]:
+            idx += 1
+            base = self._segments[idx]
+            cursor = Cursor(cursor.offset, base, self._start_position(base))
+        return cursor
+
+    def _start_position(self, base, suffixes=None):
+        suffix = (suffixes or self._suffixes)[base]
+        return BINARY_HEADER.size if suffix == BINARY_SUFFIX else 0
+
+    # -- maintenance -------------------------------------------------------
+
+    def _maintain(self):
+        while not self._closed:
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            with self._lock:
+                if self._closed:
+                    return
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync_locked()
+                self._compact()
+
+    def _compact(self):
+        # Delete sealed segments that lie entirely before the committed cursor.
+        while len(self._segments) > 1 and self._segments[1] <= self._committed.offset:
+            base = self._segments.pop(0)
+            try:
+                os.remove(self._path(base))
+            except FileNotFoundError:
+                pass
+            del self._suffixes[base]
+            self._records.pop(base, None)
+
+    def close(self):
+        with self._lock:
+            self._sync_locked()
+            self._writer.close()
+            self._closed = True
+        self._dir_lock.close()
+        self._wakeup.set()
+
+    def _path(self, base):
+        return os.path.join(self.directory, _segment_name(base, self._suffixes[base]))
@@ -35,4 +35,15 @@ Feature: API validation
     Examples:
       | w    |
       | -1   |
-      | 1001 |
\ No newline at end of file
+      | 1001 |
+
+  Scenario Outline: Invalid elevator_id
+    When I POST invalid payload {"position": 1, "door_status": "open", "weight": 10, "elevator_id": <id>, "seq": 3}
+    Then response status should be 400
+    And response error should contain "Invalid elevator_id"
+
+    Examples:
+      | id       |
+      | [1, 2]   |
+      | {"a": 1} |
+      | true     |
@@ -0,0 +1,45 @@
+Feature: Backlog policies
+
+  @mqtt
+  Scenario: The collapse policy merges consecutive readings with the same state
+    Given a separate bridge with BACKLOG_POLICY=collapse
+    And API is down
+    And I record current received count
+    When I publish these readings to that bridge
+      | elevator_id | position | door_status |
+      | 971         | 3        | closed      |
+      | 971         | 3        | closed      |
+      | 971         | 3        | closed      |
+      | 971         | 5        | open        |
+      | 971         | 5        | open        |
+      | 971         | 3        | closed      |
+    And I wait up to 5 seconds until that bridge has merged 3 readings
+    Then that bridge's circuit should open within 5 seconds
+    Given API is up
+    Then the cloud should receive 3 readings of elevator 971 within 10 seconds
+    And received reading 0 should be {"position": 3, "door_status": "closed"}
+    And received reading 0 should stand for 3 readings
+    And received reading 1 should be {"position": 5, "door_status": "open"}
+    And received reading 1 should stand for 2 readings
+    And received reading 2 should be {"position": 3, "door_status": "closed"}
+    And received reading 2 should stand for 1 readings
+
+  @mqtt
+  Scenario: The latest policy keeps only the newest reading per elevator
+    Given a separate bridge with BACKLOG_POLICY=latest
+    And API is down
+    And I record current received count
+    When I publish these readings to that bridge
+      | elevator_id | position | door_status |
+      | 972         | 3        | closed      |
+      | 972         | 3        | closed      |
+      | 972         | 5        | open        |
+      | 972         | 7        | closed      |
+      | 972         | 8        | open        |
+      | 972         | 2        | closed      |
+    And I wait up to 5 seconds until that bridge has merged 5 readings
+    Then that bridge's circuit should open within 5 seconds
+    Given API is up
+    Then the cloud should receive 1 readings of elevator 972 within 10 seconds
+    And received reading 0 should be {"position": 2, "door_status": "closed"}
+    And received reading 0 should stand for 6 readings
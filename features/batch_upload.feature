@@ -0,0 +1,15 @@
+Feature: Batch upload
+
+  Scenario: Batch upload validates items independently
+    When I POST batch payload [{"position": 1, "door_status": "open", "weight": 10}, {"position": 11, "door_status": "open", "weight": 10}]
+    Then response status should be 200
+    And batch item 0 status should be 200
+    And batch item 1 status should be 400
+    And batch item 1 error should contain "Invalid position"
+
+  Scenario: A batch item with an unhashable elevator_id is rejected without failing the batch
+    When I POST batch payload [{"position": 1, "door_status": "open", "weight": 10, "seq": 1}, {"position": 2, "door_status": "open", "weight": 10, "elevator_id": [1, 2], "seq": 1}]
+    Then response status should be 200
+    And batch item 0 status should be 200
+    And batch item 1 status should be 400
+    And batch item 1 error should contain "Invalid elevator_id"
@@ -0,0 +1,16 @@
+Feature: Multi-worker bridge
+
+  @mqtt
+  Scenario: Supervised workers share the subscription and report their health
+    Given a bridge supervisor with BRIDGE_WORKERS=2
+    And I record current received count
+    When I publish 20 readings of elevator 981 to that bridge
+    Then the cloud should receive 20 readings of elevator 981 within 10 seconds
+    And every supervised worker should have forwarded readings within 5 seconds
+
+  @mqtt
+  Scenario: A bridge on a shared subscription refuses delta readings
+    Given a separate bridge with SHARE_GROUP=deltas
+    When I publish sensor reading {"position": 3, "door_status": "closed", "weight": 80, "elevator_id": 982} to that bridge
+    And I publish sensor reading {"delta": true, "position": 4, "elevator_id": 982} to that bridge
+    Then that bridge's dead-letter file should contain "Delta on a shared subscription" within 5 seconds
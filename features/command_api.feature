@@ -0,0 +1,22 @@
+Feature: Command API
+
+  @mqtt
+  Scenario: A command sent through the API is acknowledged
+    When I send command "MOVE_TO_6" through the command API and wait up to 3 seconds
+    Then response status should be 200
+    And the command ack status should be "ok"
+    And elevator position should become 6
+
+  @mqtt
+  Scenario: A rejected command is acknowledged with its error
+    When I send command "MOVE_TO_42" through the command API and wait up to 3 seconds
+    Then response status should be 200
+    And the command ack status should be "error"
+    And the command ack error should contain "only supports floors between 1 and 10"
+
+  @mqtt
+  Scenario: Commands are dispatched in a batch and their round trips recorded
+    When I send commands "OPEN_DOOR, CLOSE_DOOR, MOVE_TO_2" through the command batch API and wait up to 3 seconds
+    Then response status should be 200
+    And every command in the batch should be acknowledged
+    And command stats should report round-trip percentiles
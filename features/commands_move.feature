@@ -17,4 +17,11 @@ Feature: Move elevator by cloud commands
     Then elevator position should become 5
     When I send command "MOVE_TO_5" via MQTT
     Then elevator position should become 5
-    And no error event should be published within 3 seconds
\ No newline at end of file
+    And no error event should be published within 3 seconds
+
+  @mqtt
+  Scenario: Position change is published right away
+    When I send command "MOVE_TO_2" via MQTT
+    Then elevator position should become 2
+    When I send command "MOVE_TO_8" via MQTT
+    Then elevator position should become 8 within 1 seconds
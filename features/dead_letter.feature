@@ -0,0 +1,11 @@
+Feature: Dead-letter queue
+
+  @mqtt
+  Scenario: Invalid reading is dead-lettered instead of forwarded
+    When I publish sensor reading {"position": 42, "door_status": "open", "weight": 10} via MQTT
+    Then bridge dead-letter file should contain "Invalid position" within 5 seconds
+
+  @mqtt
+  Scenario: Malformed JSON is dead-lettered
+    When I publish sensor reading {"position": via MQTT
+    Then bridge dead-letter file should contain "Invalid JSON" within 5 seconds
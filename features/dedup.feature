@@ -0,0 +1,12 @@
+Feature: Duplicate suppression
+
+  Scenario: A reading delivered twice is stored once
+    Given I record current received count
+    When I POST reading {"position": 3, "door_status": "open", "weight": 10, "elevator_id": 901, "seq": 7} 2 times
+    Then response status should be 200
+    And cloud should have stored seq 7 of elevator 901 exactly once
+
+  Scenario: A reading with an invalid sequence number is rejected
+    When I POST invalid payload {"position": 3, "door_status": "open", "weight": 10, "seq": -1}
+    Then response status should be 400
+    And response error should contain "Invalid seq"
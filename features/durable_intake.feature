@@ -0,0 +1,10 @@
+Feature: Durable intake
+
+  @mqtt
+  Scenario: Readings published while the bridge is killed and restarted all reach the cloud
+    Given a separate bridge with DURABLE_INTAKE=1
+    And I record current received count
+    When I start publishing 3000 readings of elevator 987 at QoS 1 to that bridge
+    And I kill that bridge once it has forwarded 500 readings
+    And I restart that bridge
+    Then the cloud should receive 3000 readings of elevator 987 within 60 seconds
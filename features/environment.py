@@ -2,30 +2,97 @@ import os
 import time
 import subprocess
 import signal
+import threading
+
+import requests
 
 # Import MQTT helpers from steps; environment.py runs as part of Behave's
 # lifecycle so we centralize per-scenario setup here.
 from features.steps import mqtt_steps as mqtt_helpers
 
+# TEST_MODE=inprocess runs everything inside the behave process against the
+# embedded MQTT broker stand-in (no Mosquitto needed); the default starts
+# each component as a subprocess against the broker on localhost:1883.
+TEST_MODE = os.getenv("TEST_MODE", "subprocess")
+# Per-worker topology; run_parallel.py gives every worker its own API port,
+# topic prefix (TOPIC_PREFIX, read by the components and the MQTT steps),
+# queue directory and log directory.
+API_PORT = os.getenv("API_PORT", "5000")
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+
+
+def start_in_process(context):
+    """Start broker, API, simulator and bridge on threads of this process.
+
+    Each component is waited for through a readiness signal: the broker and
+    the HTTP server are ready once their sockets are bound, the simulator
+    and the bridge once the broker sees their subscriptions.
+    """
+    from werkzeug.serving import make_server
+    from mqtt_broker import Broker
+
+    os.environ.setdefault("QUEUE_DIR", "/tmp/bridge_queue_inprocess")
+    context.broker = Broker("127.0.0.1", 0).start()
+    context.mqtt_port = context.broker.port
+    os.environ.update({
+        "MQTT_BROKER": "127.0.0.1",
+        "MQTT_PORT": str(context.broker.port),
+        "METRICS_PORT": "0",
+        # short intervals: nothing has to wait for a 5 second tick
+        "HEARTBEAT_INTERVAL": "0.5",
+        "FLUSH_INTERVAL": "0.5",
+        "RETRY_BASE_DELAY": "0.2",
+        "RETRY_MAX_DELAY": "1.0",
+    })
+
+    import mock_api
+    context.api_server = make_server("127.0.0.1", 0, mock_api.app, threaded=True)
+    api_base = f"http://127.0.0.1:{context.api_server.server_port}"
+    os.environ["API_BASE"] = api_base
+    os.environ["API_URL"] = f"{api_base}/elevator-data"
+    threading.Thread(target=context.api_server.serve_forever, name="api", daemon=True).start()
+
+    # both modules read their configuration on import, so import them only
+    # now that the environment points at the embedded services
+    import mock_elevator_mqtt
+    import bridge
+    threading.Thread(target=mock_elevator_mqtt.main, name="simulator", daemon=True).start()
+    if not context.broker.wait_for_subscriber(mock_elevator_mqtt.TOPIC_COMMAND):
+        raise RuntimeError("simulator did not subscribe to its command topic")
+    threading.Thread(target=bridge.main, name="bridge", daemon=True).start()
+    if not context.broker.wait_for_subscriber(bridge.TOPIC_DATA):
+        raise RuntimeError("bridge did not subscribe to the sensor topic")
+
+
 def before_all(context):
+    context.mqtt_port = 1883
+    if TEST_MODE == "inprocess":
+        start_in_process(context)
+        return
+
     # Ensure a logs directory exists so subprocess stdout/stderr can be captured
-    os.makedirs("logs", exist_ok=True)
+    os.makedirs(LOG_DIR, exist_ok=True)
 
     # Keep references to launched subprocesses so we can terminate them later
     context.processes = []
 
     # Prepare environment variables for subprocesses. These values can be
     # overridden by real environment variables (useful in CI or local .env).
+    # The steps read API_BASE and QUEUE_DIR from this process' environment.
+    os.environ["API_BASE"] = f"http://localhost:{API_PORT}"
+    os.environ.setdefault("QUEUE_DIR", "/tmp/bridge_queue")
     env = os.environ.copy()
-    env["API_URL"] = "http://localhost:5000/elevator-data"
-    env["QUEUE_FILE"] = "/tmp/bridge_queue.jsonl"
+    env["API_PORT"] = API_PORT
+    env["API_URL"] = f"http://localhost:{API_PORT}/elevator-data"
     env["FLUSH_INTERVAL"] = "2.0"
+    # Cap the outage backoff so recovery scenarios don't wait a full minute.
+    env["RETRY_MAX_DELAY"] = "4.0"
 
     # Open log files for capturing each component's output. We keep the file
     # handles in context so they can be closed in after_all.
-    api_log = open("logs/mock_api.log", "w")
-    elev_log = open("logs/mock_elevator.log", "w")
-    bridge_log = open("logs/bridge.log", "w")
+    api_log = open(os.path.join(LOG_DIR, "mock_api.log"), "w")
+    elev_log = open(os.path.join(LOG_DIR, "mock_elevator.log"), "w")
+    bridge_log = open(os.path.join(LOG_DIR, "bridge.log"), "w")
 
     context._log_files = [api_log, elev_log, bridge_log]
 
@@ -58,6 +125,13 @@ def before_all(context):
 
 
 def after_all(context):
+    if TEST_MODE == "inprocess":
+        # Simulator and bridge run on daemon threads and end with the
+        # process; stopping the broker first cuts off their traffic.
+        context.broker.stop()
+        context.api_server.shutdown()
+        return
+
     # Gracefully terminate any subprocesses we started. We first check whether
     # the process is still running (poll() is None). If it is, we send
     # SIGTERM to request termination.
@@ -89,11 +163,17 @@ def before_scenario(context, scenario):
     tagged with @mqtt to avoid starting MQTT client for unrelated tests."""
     tags = getattr(scenario, "tags", [])
     if "mqtt" in tags:
-        mqtt_helpers.setup_mqtt(context)
+        mqtt_helpers.setup_mqtt(context, port=context.mqtt_port)
 
 
 def after_scenario(context, scenario):
     """Per-scenario teardown. Only teardown MQTT if it was setup."""
     tags = getattr(scenario, "tags", [])
     if "mqtt" in tags:
-        mqtt_helpers.teardown_mqtt(context)
\ No newline at end of file
+        mqtt_helpers.teardown_mqtt(context)
+    # A scenario that takes the API down must not leave it down for the
+    # next one, whatever its outcome.
+    try:
+        requests.post(os.environ["API_BASE"] + "/simulate_failure", json={"down": False}, timeout=2)
+    except requests.RequestException:
+        pass
\ No newline at end of file
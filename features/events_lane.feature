@@ -0,0 +1,15 @@
+Feature: Priority event forwarding
+
+  @mqtt
+  Scenario: Error events are forwarded to the cloud
+    When I send command "MOVE_TO_11" via MQTT
+    Then the cloud should receive an error event containing "only supports floors between 1 and 10" within 3 seconds
+
+  @mqtt
+  Scenario: Events queued during an outage are delivered once the API is back
+    Given API is down
+    When I wait up to 15 seconds until queue has at least 2 items
+    And I send command "MOVE_TO_X" via MQTT
+    And I wait 1 seconds
+    Given API is up
+    Then the cloud should receive an error event containing "Invalid floor value" within 8 seconds
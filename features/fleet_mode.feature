@@ -0,0 +1,16 @@
+Feature: Fleet simulator
+
+  @mqtt
+  Scenario: Fleet elevators publish their state on connect and after a command
+    Given a separate bridge
+    And I record current received count
+    And a fleet simulator with FLEET_SIZE=3
+    Then the cloud should receive 1 readings of elevator 2 within 5 seconds
+    When I send command "MOVE_TO_5" to fleet elevator 2
+    Then the cloud should receive 2 readings of elevator 2 within 5 seconds
+    And received reading 1 should be {"position": 5, "door_status": "closed"}
+
+  @mqtt
+  Scenario: The fleet simulator keeps running when its bursts fall behind
+    Given a fleet simulator with FLEET_SIZE=50, HEARTBEAT_INTERVAL=30, BURST_SIZE=20, BURST_EVERY=0.01
+    Then the fleet simulator should still be running after 3 seconds
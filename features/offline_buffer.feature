@@ -5,4 +5,30 @@ Feature: Offline buffering
     When I wait up to 15 seconds until queue has at least 2 items
     Then bridge queue file should have at least 2 items
     Given API is up
-    Then bridge queue file should be empty within 15 seconds
\ No newline at end of file
+    Then bridge queue file should be empty within 15 seconds
+
+  @mqtt
+  Scenario: A batch the API refuses while the circuit is open is resolved
+    Given a separate bridge
+    And API is down
+    When I publish 4 readings of elevator 941 to that bridge
+    Then that bridge's circuit should open within 5 seconds
+    Given API rejects every reading with status 400
+    Then that bridge's queue should be empty within 10 seconds
+    And that bridge's dead-letter file should contain "API returned 400" within 2 seconds
+    Given API is up
+    And I record current received count
+    When I publish sensor reading {"position": 4, "door_status": "open", "weight": 10, "elevator_id": 942} to that bridge
+    Then the cloud should receive 1 readings of elevator 942 within 5 seconds
+
+  @mqtt
+  Scenario: A reading queued during an outage is stored as a binary record and delivered intact
+    Given a separate bridge
+    And API is down
+    And I record current received count
+    When I publish sensor reading {"position": 6, "door_status": "open", "weight": 321, "maintenance_mode": true, "elevator_id": 961, "seq": 42} to that bridge
+    And I wait up to 5 seconds until that bridge holds 1 queued readings
+    Then that bridge's queue should hold 1 binary records and no JSON records
+    Given API is up
+    Then the cloud should receive 1 readings of elevator 961 within 10 seconds
+    And received reading 0 should be {"position": 6, "door_status": "open", "weight": 321, "maintenance_mode": true, "seq": 42}
@@ -0,0 +1,13 @@
+Feature: Passthrough forwarding
+
+  @mqtt
+  Scenario: Passthrough forwards valid readings, expands deltas and dead-letters malformed ones
+    Given a separate bridge with PASSTHROUGH=1
+    And I record current received count
+    When I publish sensor reading {"position": 2, "door_status": "closed", "weight": 90, "elevator_id": 983} to that bridge
+    And I publish sensor reading {"delta": true, "position": 5, "elevator_id": 983} to that bridge
+    Then the cloud should receive 2 readings of elevator 983 within 5 seconds
+    And received reading 0 should be {"position": 2, "door_status": "closed", "weight": 90}
+    And received reading 1 should be {"position": 5, "door_status": "closed", "weight": 90}
+    When I publish sensor reading {"position": 2, "door_status": "open",, "elevator_id": 983} to that bridge
+    Then that bridge's dead-letter file should contain "API returned 400" within 5 seconds
@@ -0,0 +1,19 @@
+Feature: Received messages paging
+
+  Scenario: Fetch only new messages with a cursor
+    Given I record current received count
+    When I POST batch payload [{"position": 2, "door_status": "open", "weight": 1}, {"position": 3, "door_status": "open", "weight": 2}, {"position": 4, "door_status": "open", "weight": 3}]
+    Then fetching received since the recorded count with limit 2 should return 2 new messages
+
+  Scenario: Fetch readings by time range
+    Given I record the current time
+    When I POST batch payload [{"position": 2, "door_status": "open", "weight": 1}, {"position": 3, "door_status": "open", "weight": 2}, {"position": 4, "door_status": "open", "weight": 3}]
+    And I fetch received readings since the recorded time with limit 2
+    Then response status should be 200
+    And the response should list 2 readings from the recorded time on
+
+  Scenario: A negative time range limit is rejected
+    Given I record the current time
+    When I fetch received readings since the recorded time with limit -1
+    Then response status should be 400
+    And response error should contain "Invalid query parameter"
@@ -5,25 +5,35 @@ import os
 import json
 from behave import given, when, then
 
-# Base URL for the mock API. Tests assume the API is running on localhost:5000
-API_BASE = "http://localhost:5000"
-QUEUE_FILE = os.getenv("QUEUE_FILE", "/tmp/bridge_queue.jsonl")
+from durable_queue import pending_count
 
+# The mock API and the bridge queue default to localhost:5000 and
+# /tmp/bridge_queue; environment.py overrides both in the in-process mode,
+# so they are looked up when used rather than at import.
+def api(path):
+    return os.getenv("API_BASE", "http://localhost:5000") + path
 
-def get_received():
-    """Fetch all messages stored by the mock API."""
-    resp = requests.get(f"{API_BASE}/received", timeout=2)
+def queue_dir():
+    return os.getenv("QUEUE_DIR", "/tmp/bridge_queue")
+
+
+def get_received_count(min_count=None, wait=0):
+    """Fetch the total number of messages ingested by the mock API.
+
+    Uses the O(1) count endpoint rather than downloading the full history.
+    With ``min_count`` the API holds the request until that many messages
+    have arrived or ``wait`` seconds have passed.
+    """
+    params = {"min_count": min_count, "wait": wait} if min_count is not None else None
+    resp = requests.get(api("/received/count"), params=params, timeout=wait + 2)
     resp.raise_for_status()
-    return resp.json()
+    return resp.json()["count"]
 
 def read_queue_count():
-    """Count JSONL items in the bridge queue file."""
-    if not os.path.exists(QUEUE_FILE):
-        return 0
-    with open(QUEUE_FILE, "r") as f:
-        return sum(1 for line in f if line.strip())
+    """Count unacked items in the bridge's on-disk queue."""
+    return pending_count(queue_dir())
 
-def wait_until(predicate, timeout=10, interval=0.2):
+def wait_until(predicate, timeout=10, interval=0.05):
     """Poll a predicate until True or timeout; returns True/False."""
     deadline = time.time() + timeout
     while time.time() < deadline:
@@ -41,7 +51,7 @@ def step_api_up(context):
     set to true, makes the API return 500 for /elevator-data. Tests toggle
     this to simulate network/server outages.
     """
-    requests.post(f"{API_BASE}/simulate_failure", json={"down": False}, timeout=2)
+    requests.post(api("/simulate_failure"), json={"down": False}, timeout=2)
 
 
 @given("API is down")
@@ -51,7 +61,7 @@ def step_api_down(context):
     This is used by offline-buffering scenarios to exercise the bridge's
     local queueing and retry behavior.
     """
-    requests.post(f"{API_BASE}/simulate_failure", json={"down": True}, timeout=2)
+    requests.post(api("/simulate_failure"), json={"down": True}, timeout=2)
 
 
 @when("I wait {seconds:d} seconds")
@@ -61,14 +71,14 @@ def step_wait_seconds(context, seconds):
 
 @given("I record current received count")
 def step_record_received(context):
-    """Store the current list of received messages on the shared context so
+    """Store the current received count on the shared context so
     subsequent steps can measure deltas.
     """
-    context.received_before = get_received()
+    context.received_count = get_received_count()
 
 @then("cloud should have received at least {count:d} new messages")
 def step_received_at_least(context, count):
-    current = len(get_received())
+    current = get_received_count()
     assert current >= context.received_count + count, (
         f"Expected at least {count} new messages, got {current - context.received_count}"
     )
@@ -77,9 +87,73 @@ def step_received_at_least(context, count):
 @then("cloud should have received at least {count:d} new messages within {seconds:d} seconds")
 def step_received_at_least_within(context, count, seconds):
     start = getattr(context, "received_count", 0)
-    ok = wait_until(lambda: len(get_received()) >= start + count, timeout=seconds)
+    ok = get_received_count(min_count=start + count, wait=seconds) >= start + count
     assert ok, f"Did not receive {count} new messages within {seconds}s"
 
+@then("fetching received since the recorded count with limit {limit:d} should return {count:d} new messages")
+def step_received_since(context, limit, count):
+    resp = requests.get(
+        api("/received"),
+        params={"since": context.received_count, "limit": limit},
+        timeout=2,
+    )
+    resp.raise_for_status()
+    items = resp.json()
+    assert len(items) == count, f"Expected {count} messages, got {len(items)}"
+    assert all(item["seq"] >= context.received_count for item in items)
+
+@given("I record the current time")
+def step_record_time(context):
+    context.recorded_at = time.time()
+
+@when("I fetch received readings since the recorded time with limit {limit:d}")
+def step_received_range(context, limit):
+    context.last_response = requests.get(
+        api("/received/range"),
+        params={"start": context.recorded_at, "limit": limit},
+        timeout=2,
+    )
+
+@then("the response should list {count:d} readings from the recorded time on")
+def step_range_items(context, count):
+    items = context.last_response.json()
+    assert len(items) == count, f"Expected {count} readings, got {len(items)}"
+    stamps = [item["ts"] for item in items]
+    assert stamps == sorted(stamps) and stamps[0] >= context.recorded_at, stamps
+
+@given("I record the telemetry stats")
+def step_record_stats(context):
+    resp = requests.get(api("/stats"), timeout=2)
+    resp.raise_for_status()
+    context.recorded_stats = resp.json()
+
+@then("stats should count at least {count:d} more readings on floor {floor:d}")
+def step_stats_floor(context, count, floor):
+    stats = requests.get(api("/stats"), timeout=2).json()
+    before = context.recorded_stats["floors"][str(floor)]["count"]
+    after = stats["floors"][str(floor)]["count"]
+    assert after - before >= count, f"Floor {floor} count went from {before} to {after}"
+    assert stats["total"] - context.recorded_stats["total"] >= count
+
+@then("stats should count at least {count:d} more door openings")
+def step_stats_doors(context, count):
+    stats = requests.get(api("/stats"), timeout=2).json()
+    before = context.recorded_stats["door"]["openings"]
+    assert stats["door"]["openings"] - before >= count, stats["door"]
+
+@when("I request the stats series at resolution {resolution:d} with {points:d} points")
+def step_stats_series(context, resolution, points):
+    context.last_response = requests.get(
+        api("/stats/series"), params={"resolution": resolution, "points": points}, timeout=2
+    )
+
+@then("the series should have {points:d} points with at least {count:d} readings in total")
+def step_series_points(context, points, count):
+    series = context.last_response.json()
+    assert len(series) == points, f"Expected {points} points, got {len(series)}"
+    assert [p["ts"] for p in series] == sorted(p["ts"] for p in series)
+    assert sum(p["count"] for p in series) >= count, series
+
 @when("I wait up to {seconds:d} seconds until queue has at least {count:d} items")
 def step_wait_queue_at_least(context, seconds, count):
     ok = wait_until(lambda: read_queue_count() >= count, timeout=seconds)
@@ -92,7 +166,85 @@ def step_post_invalid(context, payload):
     response on `context.last_response` for later assertions.
     """
     data = json.loads(payload)
-    context.last_response = requests.post(f"{API_BASE}/elevator-data", json=data, timeout=2)
+    context.last_response = requests.post(api("/elevator-data"), json=data, timeout=2)
+
+
+@when('I POST reading {payload} {times:d} times')
+def step_post_repeated(context, payload, times):
+    """POST the same reading several times, as a retrying sender would."""
+    data = json.loads(payload)
+    for _ in range(times):
+        context.last_response = requests.post(api("/elevator-data"), json=data, timeout=2)
+
+
+@then('cloud should have stored seq {seq:d} of elevator {elevator_id:d} exactly once')
+def step_stored_once(context, seq, elevator_id):
+    resp = requests.get(api("/received"), params={"since": context.received_count}, timeout=2)
+    resp.raise_for_status()
+    matches = [
+        item for item in resp.json()
+        if item["data"].get("elevator_id") == elevator_id and item["data"].get("seq") == seq
+    ]
+    assert len(matches) == 1, f"Expected 1 stored copy, got {len(matches)}"
+
+
+@when('I POST batch payload {payload}')
+def step_post_batch(context, payload):
+    """POST a JSON list of readings to the batch endpoint."""
+    data = json.loads(payload)
+    context.last_response = requests.post(api("/elevator-data/batch"), json=data, timeout=2)
+
+
+@then('batch item {index:d} status should be {status:d}')
+def step_batch_item_status(context, index, status):
+    results = context.last_response.json()["results"]
+    assert results[index]["status"] == status, f"Item {index}: {results[index]}"
+
+
+@then('batch item {index:d} error should contain "{text}"')
+def step_batch_item_error(context, index, text):
+    results = context.last_response.json()["results"]
+    assert text in results[index].get("error", "")
+
+
+@when('I send command "{command}" through the command API and wait up to {seconds:d} seconds')
+def step_command_api(context, command, seconds):
+    """Dispatch a command through the mock cloud and wait for its ack."""
+    context.last_response = requests.post(
+        api("/commands"), json={"command": command, "wait": seconds}, timeout=seconds + 2
+    )
+
+
+@when('I send commands "{commands}" through the command batch API and wait up to {seconds:d} seconds')
+def step_command_batch_api(context, commands, seconds):
+    """Dispatch a comma-separated list of commands in one batch request."""
+    body = {"commands": [{"command": c.strip()} for c in commands.split(",")], "wait": seconds}
+    context.last_response = requests.post(api("/commands/batch"), json=body, timeout=seconds + 2)
+
+
+@then('the command ack status should be "{status}"')
+def step_command_ack_status(context, status):
+    body = context.last_response.json()
+    assert body["status"] == status, f"Command not acked with {status}: {body}"
+
+
+@then('the command ack error should contain "{text}"')
+def step_command_ack_error(context, text):
+    assert text in context.last_response.json().get("error", "")
+
+
+@then('every command in the batch should be acknowledged')
+def step_batch_commands_acked(context):
+    cmds = context.last_response.json()["commands"]
+    assert all(cmd["status"] == "ok" for cmd in cmds), cmds
+
+
+@then('command stats should report round-trip percentiles')
+def step_command_stats(context):
+    stats = requests.get(api("/commands/stats"), timeout=2).json()
+    rtt = stats["rtt_ms"]
+    assert stats["acked"] > 0 and rtt["samples"] > 0, stats
+    assert 0 <= rtt["p50"] <= rtt["p90"] <= rtt["p99"] <= rtt["max"], rtt
 
 
 @then('response status should be {status:d}')
@@ -118,4 +270,34 @@ def step_queue_at_least(context, count):
 @then("bridge queue file should be empty within {seconds:d} seconds")
 def step_queue_empty_within(context, seconds):
     ok = wait_until(lambda: read_queue_count() == 0, timeout=seconds)
-    assert ok, f"Queue not empty after {seconds}s"
\ No newline at end of file
+    assert ok, f"Queue not empty after {seconds}s"
+
+@then('the cloud should receive an error event containing "{text}" within {seconds:d} seconds')
+def step_cloud_event(context, text, seconds):
+    """Wait for the API to have received an error event (sent after the
+    last command) whose ``error`` text contains ``text``."""
+    since = getattr(context, "command_sent_at", 0)
+
+    def found():
+        resp = requests.get(api("/events"), timeout=2)
+        resp.raise_for_status()
+        return any(
+            text in item["data"].get("error", "") and item["data"]["ts"] >= since
+            for item in resp.json()
+        )
+
+    assert wait_until(found, timeout=seconds), f'No error event containing "{text}" after {seconds}s'
+
+@then('bridge dead-letter file should contain "{text}" within {seconds:d} seconds')
+def step_dead_letter_contains(context, text, seconds):
+    path = os.path.join(queue_dir(), "dead_letter.jsonl")
+    since = getattr(context, "published_at", 0)
+
+    def found():
+        if not os.path.exists(path):
+            return False
+        with open(path, "r") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return any(text in r["reason"] and r["ts"] >= since for r in records)
+
+    assert wait_until(found, timeout=seconds), f'"{text}" not dead-lettered after {seconds}s'
@@ -0,0 +1,428 @@
+import contextlib
+import glob
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from behave import given, when, then
+
+import durable_queue
+import traffic_capture
+
+# Steps that start an extra bridge next to the one environment.py runs, on
+# its own topic prefix, queue directory and metrics port, so settings such
+# as BACKLOG_POLICY or PASSTHROUGH can be tested without restarting the
+# suite. The extra bridge talks to the same broker and mock API and is
+# stopped when the scenario ends. Scenarios using it need @mqtt.
+
+TOPIC_PREFIX = os.getenv("TOPIC_PREFIX", "")
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_instances = itertools.count()
+
+
+def api(path):
+    return os.getenv("API_BASE", "http://localhost:5000") + path
+
+
+def free_port(count=1):
+    """A port that is free along with the ``count - 1`` above it (the
+    supervisor serves worker metrics on the ports after its own). Picked
+    below the ephemeral range, so outgoing connections can't take them."""
+    while True:
+        base = random.randrange(20000, 32000)
+        try:
+            with contextlib.ExitStack() as stack:
+                for port in range(base, base + count):
+                    stack.enter_context(socket.socket()).bind(("127.0.0.1", port))
+            return base
+        except OSError:
+            continue
+
+
+def parse_settings(settings):
+    """``"A=1, B=x"`` -> ``{"A": "1", "B": "x"}``."""
+    return dict(item.strip().split("=", 1) for item in settings.split(",") if item.strip())
+
+
+def wait_until(predicate, timeout, interval=0.1):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def spawn(context, script, env, n):
+    """Run ``script`` with ``env``, logging to LOG_DIR; it is stopped when
+    the scenario ends."""
+    log_dir = os.getenv("LOG_DIR", "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    log = open(os.path.join(log_dir, f"extra_{os.path.splitext(script)[0]}_{n}.log"), "w")
+    proc = subprocess.Popen([sys.executable, "-u", script], stdout=log, stderr=subprocess.STDOUT,
+                            env=env, cwd=ROOT)
+
+    def stop():
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        log.close()
+
+    context.add_cleanup(stop)
+    return proc
+
+
+def start_extra_bridge(context, script, settings):
+    """Start ``script`` (bridge.py or bridge_supervisor.py) with ``settings``
+    on top of a private topology, and wait until it forwards readings.
+    ``{queue_dir}`` in a setting stands for the bridge's queue directory."""
+    n = next(_instances)
+    prefix = f"{TOPIC_PREFIX}extra{os.getpid()}-{n}/"
+    queue_dir = tempfile.mkdtemp(prefix="bridge_extra_")
+    workers = int(settings.get("BRIDGE_WORKERS", os.cpu_count() or 1)) if script == "bridge_supervisor.py" else 0
+    metrics_port = free_port(1 + workers)
+    env = os.environ.copy()
+    env.update({
+        "MQTT_PORT": str(context.mqtt_port),
+        "API_URL": api("/elevator-data"),
+        "TOPIC_PREFIX": prefix,
+        "QUEUE_DIR": queue_dir,
+        "METRICS_PORT": str(metrics_port),
+        "FLUSH_INTERVAL": "0.5",
+        "RETRY_BASE_DELAY": "0.2",
+        "RETRY_MAX_DELAY": "1.0",
+        "HEALTH_INTERVAL": "0.5",
+        # one sender keeps queued readings in arrival order
+        "SENDER_WORKERS": "1",
+        # unique, so a DURABLE_INTAKE session never resumes an earlier run's
+        "MQTT_CLIENT_ID": f"extra{os.getpid()}-{n}",
+    })
+    if script == "bridge_supervisor.py":
+        # the supervisor derives its workers' client ids from the group
+        env["SHARE_GROUP"] = f"extra{os.getpid()}-{n}"
+    env.update((key, value.format(queue_dir=queue_dir)) for key, value in settings.items())
+    proc = spawn(context, script, env, n)
+    context.add_cleanup(shutil.rmtree, queue_dir, ignore_errors=True)
+    context.extra_bridge = {
+        "script": script,
+        "env": env,
+        "proc": proc,
+        "prefix": prefix,
+        "queue_dir": queue_dir,
+        "health_url": f"http://127.0.0.1:{metrics_port}/healthz",
+        "metrics_url": f"http://127.0.0.1:{metrics_port}/metrics",
+    }
+
+    wait_forwarding(context, settle=True)
+
+
+def wait_forwarding(context, settle=False):
+    """Wait until a reading published on the extra bridge's topic has been
+    forwarded."""
+    def forwarded():
+        publish(context, {"position": 1, "door_status": "closed", "weight": 0, "elevator_id": 999})
+        health = extra_health(context)
+        return health is not None and health["forwarded"] > 0
+
+    # With settle, also wait until everything the bridge received has been
+    # forwarded and stays that way for one poll: a warm-up reading still in
+    # flight when the scenario takes the API down would be queued next to its
+    # own readings. The supervisor has no such counters and counts as settled.
+    last = []
+
+    def settled():
+        counts = (extra_metric(context, "bridge_messages_received_total"),
+                  extra_metric(context, "bridge_messages_forwarded_total"))
+        steady = counts[0] == counts[1] and counts == tuple(last)
+        last[:] = counts
+        return steady
+
+    script = context.extra_bridge["script"]
+    ok = context.extra_bridge["proc"].poll() is None and wait_until(forwarded, 15, interval=0.5)
+    assert ok, f"{script} did not start forwarding"
+    if settle:
+        assert wait_until(settled, 5, interval=0.3), f"{script} kept receiving warm-up readings"
+
+
+def extra_health(context):
+    try:
+        return requests.get(context.extra_bridge["health_url"], timeout=1).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def extra_metric(context, name):
+    try:
+        text = requests.get(context.extra_bridge["metrics_url"], timeout=1).text
+    except requests.RequestException:
+        return None
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    return None
+
+
+def publish(context, payload):
+    data = payload if isinstance(payload, str) else json.dumps(payload)
+    info = context.mqtt_client.publish(context.extra_bridge["prefix"] + "elevator/sensor_data", data)
+    info.wait_for_publish()
+
+
+def stored_readings(context, elevator_id):
+    since = getattr(context, "received_count", 0)
+    resp = requests.get(api("/received"), params={"since": since}, timeout=2)
+    resp.raise_for_status()
+    return [item["data"] for item in resp.json() if item["data"].get("elevator_id") == elevator_id]
+
+
+@given('a separate bridge')
+def step_extra_bridge(context):
+    start_extra_bridge(context, "bridge.py", {})
+
+
+@given('a separate bridge with {settings}')
+def step_extra_bridge_with(context, settings):
+    start_extra_bridge(context, "bridge.py", parse_settings(settings))
+
+
+@given('a bridge supervisor with {settings}')
+def step_extra_supervisor(context, settings):
+    start_extra_bridge(context, "bridge_supervisor.py", parse_settings(settings))
+
+
+@given('a fleet simulator with {settings}')
+def step_fleet_simulator(context, settings):
+    """Run a fleet simulator on that bridge's topics, or on topics of its
+    own (that nothing forwards) when no separate bridge was started."""
+    n = next(_instances)
+    extra = getattr(context, "extra_bridge", None)
+    env = os.environ.copy()
+    env.update({
+        "MQTT_PORT": str(context.mqtt_port),
+        "TOPIC_PREFIX": extra["prefix"] if extra else f"{TOPIC_PREFIX}fleet{os.getpid()}-{n}/",
+        "HEARTBEAT_INTERVAL": "0",
+    })
+    env.update(parse_settings(settings))
+    context.fleet_prefix = env["TOPIC_PREFIX"]
+    context.fleet_simulator = spawn(context, "mock_elevator_mqtt.py", env, n)
+
+
+@when('I send command "{command}" to fleet elevator {elevator_id:d}')
+def step_fleet_command(context, command, elevator_id):
+    topic = f"{context.fleet_prefix}elevator/{elevator_id}/command"
+    context.mqtt_client.publish(topic, command, qos=1).wait_for_publish()
+
+
+@then('the fleet simulator should still be running after {seconds:d} seconds')
+def step_fleet_running(context, seconds):
+    time.sleep(seconds)
+    code = context.fleet_simulator.poll()
+    assert code is None, f"Fleet simulator exited with {code}"
+
+
+@given('API rejects every reading with status {status:d}')
+def step_api_rejects(context, status):
+    requests.post(api("/simulate_failure"), json={"down": True, "status": status}, timeout=2)
+
+
+@when('I publish sensor reading {payload} to that bridge')
+def step_publish_extra(context, payload):
+    context.published_at = time.time()
+    publish(context, payload)
+
+
+@when('I publish these readings to that bridge')
+def step_publish_table(context):
+    """Publish one reading per table row, in order; columns are reading
+    fields (integers where they parse as such)."""
+    context.published_at = time.time()
+    for row in context.table:
+        reading = {"weight": 100}
+        for key in row.headings:
+            value = row[key]
+            reading[key] = int(value) if value.lstrip("-").isdigit() else value
+        publish(context, reading)
+
+
+@when('I publish {count:d} readings of elevator {elevator_id:d} to that bridge')
+def step_publish_many(context, count, elevator_id):
+    context.published_at = time.time()
+    for i in range(count):
+        publish(context, {"position": 1 + i % 10, "door_status": "closed", "weight": 100,
+                          "elevator_id": elevator_id})
+
+
+@when('I start publishing {count:d} readings of elevator {elevator_id:d} at QoS 1 to that bridge')
+def step_publish_background(context, count, elevator_id):
+    """Publish in the background, so the bridge can be killed mid-stream.
+    Readings carry a seq, so the API drops the ones delivered twice."""
+    topic = context.extra_bridge["prefix"] + "elevator/sensor_data"
+    base = int(time.time() * 1000)
+
+    def run():
+        info = None
+        for i in range(count):
+            reading = {"position": 1 + i % 10, "door_status": "closed", "weight": 100,
+                       "elevator_id": elevator_id, "seq": base + i}
+            info = context.mqtt_client.publish(topic, json.dumps(reading), qos=1)
+        info.wait_for_publish()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    context.add_cleanup(thread.join, 30)
+
+
+@when('I kill that bridge once it has forwarded {count:d} readings')
+def step_kill_extra(context, count):
+    ok = wait_until(lambda: (extra_health(context) or {}).get("forwarded", 0) >= count, 15)
+    assert ok, f"Extra bridge did not forward {count} readings: {extra_health(context)}"
+    proc = context.extra_bridge["proc"]
+    proc.kill()
+    proc.wait()
+
+
+@when('I restart that bridge')
+def step_restart_extra(context):
+    bridge = context.extra_bridge
+    bridge["proc"] = spawn(context, bridge["script"], bridge["env"], next(_instances))
+    wait_forwarding(context)
+
+
+@then("that bridge's circuit should open within {seconds:d} seconds")
+def step_extra_circuit_open(context, seconds):
+    ok = wait_until(lambda: (extra_health(context) or {}).get("circuit_open"), seconds)
+    assert ok, f"Circuit not open after {seconds}s"
+
+
+@when("I wait up to {seconds:d} seconds until that bridge holds {count:d} queued readings")
+def step_extra_queue_depth(context, seconds, count):
+    ok = wait_until(lambda: (extra_health(context) or {}).get("queue_depth", 0) >= count, seconds)
+    assert ok, f"Extra bridge did not queue {count} readings within {seconds}s: {extra_health(context)}"
+
+
+@then("that bridge's queue should hold {count:d} binary records and no JSON records")
+def step_extra_binary_records(context, count):
+    queue_dir = context.extra_bridge["queue_dir"]
+
+    def records():
+        binary = json_records = 0
+        for base, suffix in durable_queue._list_segments(queue_dir).items():
+            path = os.path.join(queue_dir, durable_queue._segment_name(base, suffix))
+            if suffix == durable_queue.BINARY_SUFFIX:
+                record = durable_queue._binary_record(path)
+                binary += (os.path.getsize(path) - durable_queue.BINARY_HEADER.size) // record.size
+            else:
+                with open(path, "rb") as f:
+                    json_records += sum(1 for _ in f)
+        return binary, json_records
+
+    # appended records reach the file within the queue's FSYNC_INTERVAL
+    wait_until(lambda: records() == (count, 0), 3)
+    assert records() == (count, 0), "%d binary and %d JSON records" % records()
+
+
+@when("I wait up to {seconds:d} seconds until that bridge has merged {count:d} readings")
+def step_extra_coalesced(context, seconds, count):
+    ok = wait_until(lambda: (extra_metric(context, "bridge_messages_coalesced_total") or 0) >= count, seconds)
+    assert ok, f"Extra bridge did not merge {count} readings within {seconds}s"
+
+
+@then("that bridge's queue should be empty within {seconds:d} seconds")
+def step_extra_queue_empty(context, seconds):
+    ok = wait_until(lambda: (extra_health(context) or {}).get("queue_depth") == 0, seconds)
+    assert ok, f"Extra bridge queue not empty after {seconds}s: {extra_health(context)}"
+
+
+@then("that bridge's dead-letter file should contain \"{text}\" within {seconds:d} seconds")
+def step_extra_dead_letter(context, text, seconds):
+    path = os.path.join(context.extra_bridge["queue_dir"], "dead_letter.jsonl")
+    since = getattr(context, "published_at", 0)
+
+    def found():
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return any(text in r["reason"] and r["ts"] >= since for r in records)
+
+    assert wait_until(found, seconds), f'"{text}" not dead-lettered after {seconds}s'
+
+
+def captured_files(context):
+    return sorted(glob.glob(os.path.join(context.extra_bridge["queue_dir"], "*.evcap")))
+
+
+@then("that bridge's captures should hold {count:d} readings of elevator {elevator_id:d} within {seconds:d} seconds")
+def step_extra_captured(context, count, elevator_id, seconds):
+    """The bridge is still running: only what it has flushed is counted."""
+    def captured():
+        total = 0
+        for path in captured_files(context):
+            try:
+                total += sum(traffic_capture.elevator_key(topic, payload) == str(elevator_id)
+                             for _, topic, payload in traffic_capture.read_capture(path))
+            except ValueError:
+                pass  # not even the header flushed yet
+        return total
+
+    ok = wait_until(lambda: captured() >= count, seconds)
+    assert ok and captured() == count, f"Captured {captured()} readings of elevator {elevator_id}"
+
+
+@then("that bridge should have written {count:d} capture files")
+def step_extra_capture_files(context, count):
+    files = captured_files(context)
+    assert len(files) == count, files
+
+
+@then('the cloud should receive {count:d} readings of elevator {elevator_id:d} within {seconds:d} seconds')
+def step_cloud_readings(context, count, elevator_id, seconds):
+    ok = wait_until(lambda: len(stored_readings(context, elevator_id)) >= count, seconds)
+    context.elevator_readings = stored_readings(context, elevator_id)
+    assert ok and len(context.elevator_readings) == count, (
+        f"Expected {count} readings of elevator {elevator_id}, got {context.elevator_readings}"
+    )
+
+
+@then('received reading {index:d} should be {fields}')
+def step_reading_fields(context, index, fields):
+    """``fields`` is a JSON object the reading must contain."""
+    reading = context.elevator_readings[index]
+    expected = json.loads(fields)
+    assert {k: reading.get(k) for k in expected} == expected, reading
+
+
+@then('received reading {index:d} should stand for {count:d} readings')
+def step_reading_coalesced(context, index, count):
+    reading = context.elevator_readings[index]
+    run = reading.get("coalesced")
+    if count == 1:
+        assert run is None, reading
+    else:
+        assert run is not None and run["count"] == count, reading
+        assert run["first_ts"] <= run["last_ts"], reading
+
+
+@then('every supervised worker should have forwarded readings within {seconds:d} seconds')
+def step_supervised_workers(context, seconds):
+    def all_forwarded():
+        health = extra_health(context) or {}
+        workers = health.get("workers", [])
+        return health.get("status") == "ok" and workers and all(
+            w["health"]["forwarded"] > 0 for w in workers
+        )
+
+    assert wait_until(all_forwarded, seconds), f"Not every worker forwarded: {extra_health(context)}"
@@ -1,12 +1,20 @@
 import json
+import os
+import tempfile
+import threading
 import time
 import paho.mqtt.client as mqtt
-from behave import when, then
+import requests
+from behave import given, when, then
 
-# MQTT topics used by the elevator simulator and tests
-TOPIC_DATA = "elevator/sensor_data"
-TOPIC_COMMAND = "elevator/command"
-TOPIC_EVENTS = "elevator/events"
+import traffic_capture
+
+# MQTT topics used by the elevator simulator and tests; TOPIC_PREFIX keeps
+# parallel workers sharing a broker apart (see run_parallel.py)
+TOPIC_PREFIX = os.getenv("TOPIC_PREFIX", "")
+TOPIC_DATA = TOPIC_PREFIX + "elevator/sensor_data"
+TOPIC_COMMAND = TOPIC_PREFIX + "elevator/command"
+TOPIC_EVENTS = TOPIC_PREFIX + "elevator/events"
 
 
 def setup_mqtt(context, host="localhost", port=1883):
@@ -15,6 +23,8 @@ def setup_mqtt(context, host="localhost", port=1883):
     `features/environment.py`'s hooks (not as a step-level hook).
     """
     context.mqtt_messages = {TOPIC_DATA: [], TOPIC_EVENTS: []}
+    # notified on every message so steps can wait instead of polling
+    context.mqtt_arrived = threading.Condition()
     context.mqtt_client = mqtt.Client()
 
     def on_message(client, userdata, msg):
@@ -23,7 +33,9 @@ def setup_mqtt(context, host="localhost", port=1883):
             data = json.loads(payload)
         except json.JSONDecodeError:
             data = payload
-        context.mqtt_messages.setdefault(msg.topic, []).append(data)
+        with context.mqtt_arrived:
+            context.mqtt_messages.setdefault(msg.topic, []).append(data)
+            context.mqtt_arrived.notify_all()
 
     context.mqtt_client.on_message = on_message
     context.mqtt_client.connect(host, port)
@@ -44,17 +56,19 @@ def teardown_mqtt(context):
         pass
 
 
-def wait_for(context, topic, predicate, timeout=10):
-    """Polling helper used by steps to wait for a message on `topic` that
-    satisfies `predicate`. Returns the matching message or None on timeout.
+def wait_for(context, topic, predicate, timeout=10, skip=0):
+    """Helper used by steps to wait for a message on `topic` that
+    satisfies `predicate`, ignoring the first `skip` messages. Returns the
+    matching message or None on timeout.
     """
-    start = time.time()
-    while time.time() - start < timeout:
-        for msg in list(context.mqtt_messages.get(topic, [])):
+    def match():
+        for msg in context.mqtt_messages.get(topic, [])[skip:]:
             if predicate(msg):
                 return msg
-        time.sleep(0.1)
-    return None
+        return None
+
+    with context.mqtt_arrived:
+        return context.mqtt_arrived.wait_for(match, timeout)
 
 
 @when('I send command "{command}" via MQTT')
@@ -62,6 +76,10 @@ def step_send_command(context, command):
     """Publish a raw command string to the `TOPIC_COMMAND` topic
     This simulates the cloud (or a user) sending a command to the elevator.
     """
+    # remember how many readings arrived before the command was sent
+    with context.mqtt_arrived:
+        context.readings_before_command = len(context.mqtt_messages.get(TOPIC_DATA, []))
+    context.command_sent_at = time.time()
     context.mqtt_client.publish(TOPIC_COMMAND, command)
 
 
@@ -80,6 +98,20 @@ def step_wait_position(context, floor):
     assert msg is not None, f"Position {floor} not observed"
 
 
+@then('elevator position should become {floor:d} within {seconds:d} seconds')
+def step_wait_position_within(context, floor, seconds):
+    """Like the step above, but only readings published after the last
+    command count, and they must arrive within ``seconds``."""
+    msg = wait_for(
+        context,
+        TOPIC_DATA,
+        lambda m: isinstance(m, dict) and m.get("position") == floor,
+        timeout=seconds,
+        skip=getattr(context, "readings_before_command", 0),
+    )
+    assert msg is not None, f"Position {floor} not observed within {seconds}s"
+
+
 @then('maintenance_mode should be {state}')
 def step_maintenance(context, state):
     """Assert that a subsequent `sensor_data` message reports the
@@ -128,14 +160,83 @@ def step_error_event(context, text):
 @then('no error event should be published within {seconds:d} seconds')
 def step_no_error_event(context, seconds):
     """Ensure no new error event arrives within the given window."""
+    # Only events arriving from now on count
     start_len = len(context.mqtt_messages.get(TOPIC_EVENTS, []))
-    end_time = time.time() + seconds
-    while time.time() < end_time:
-        events = context.mqtt_messages.get(TOPIC_EVENTS, [])
-        if len(events) > start_len:
-            # Check only the newly arrived events
-            for event in events[start_len:]:
-                if isinstance(event, dict) and event.get("error"):
-                    raise AssertionError("Unexpected error event received")
-            start_len = len(events)
-        time.sleep(0.1)
\ No newline at end of file
+    event = wait_for(
+        context,
+        TOPIC_EVENTS,
+        lambda m: isinstance(m, dict) and m.get("error"),
+        timeout=seconds,
+        skip=start_len,
+    )
+    if event is not None:
+        raise AssertionError("Unexpected error event received")
+
+@when('I publish sensor reading {payload} via MQTT')
+def step_publish_reading(context, payload):
+    """Publish a raw sensor payload as if it came from the elevator."""
+    context.published_at = time.time()
+    context.mqtt_client.publish(TOPIC_DATA, payload)
+
+
+@given('a capture of {count:d} readings from {elevators:d} elevators')
+def step_capture(context, count, elevators):
+    """Write a capture of readings interleaved across ``elevators`` ids
+    (from 1001 up, clear of the simulator's), 1 ms apart, numbered from 1
+    per elevator like a real capture would be."""
+    path = os.path.join(tempfile.mkdtemp(), "readings.evcap")
+    writer = traffic_capture.CaptureWriter(path)
+    context.replay_ids = set(range(1001, 1001 + elevators))
+    for n in range(count):
+        reading = {"position": 1 + n % 10, "door_status": "closed", "weight": 100,
+                   "elevator_id": 1001 + n % elevators, "seq": 1 + n // elevators}
+        writer.write(1000.0 + n / 1000, "elevator/sensor_data", json.dumps(reading).encode())
+    writer.close()
+    context.capture_path = path
+    context.replay_count = count
+
+
+@when('I replay the capture as fast as possible over {connections:d} connections')
+def step_replay(context, connections):
+    messages = list(traffic_capture.read_capture(context.capture_path))
+    traffic_capture.replay(messages, port=context.mqtt_port, speed=0,
+                           connections=connections, prefix=TOPIC_PREFIX)
+
+
+@when('I replay the capture as fast as possible over {connections:d} connections with seq {mode}')
+def step_replay_seq(context, connections, mode):
+    messages = list(traffic_capture.read_capture(context.capture_path))
+    traffic_capture.replay(messages, port=context.mqtt_port, speed=0,
+                           connections=connections, prefix=TOPIC_PREFIX, seq=mode)
+
+
+@then('the cloud should have stored {count:d} replayed readings within {seconds:d} seconds')
+def step_replay_stored(context, count, seconds):
+    url = os.getenv("API_BASE", "http://localhost:5000") + "/received"
+
+    def stored():
+        items = requests.get(url, params={"since": context.received_count}, timeout=5).json()
+        return sum(1 for item in items if item["data"].get("elevator_id") in context.replay_ids)
+
+    deadline = time.time() + seconds
+    while stored() < count and time.time() < deadline:
+        time.sleep(0.2)
+    assert stored() == count, f"Expected {count} replayed readings stored, got {stored()}"
+
+
+@then("each elevator's replayed readings should arrive in order")
+def step_replay_ordered(context):
+    def replayed():
+        return [m for m in context.mqtt_messages.get(TOPIC_DATA, [])
+                if isinstance(m, dict) and m.get("elevator_id") in context.replay_ids]
+
+    with context.mqtt_arrived:
+        context.mqtt_arrived.wait_for(lambda: len(replayed()) >= context.replay_count, 10)
+        readings = replayed()
+    assert len(readings) == context.replay_count, (
+        f"Expected {context.replay_count} replayed readings, got {len(readings)}"
+    )
+    last = {}
+    for m in readings:
+        assert m["seq"] > last.get(m["elevator_id"], 0), f"Elevator {m['elevator_id']} out of order"
+        last[m["elevator_id"]] = m["seq"]
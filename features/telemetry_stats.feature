@@ -0,0 +1,18 @@
+Feature: Telemetry statistics
+
+  Scenario: Aggregates take in every accepted reading
+    Given I record the telemetry stats
+    When I POST batch payload [{"position": 7, "door_status": "open", "weight": 120, "elevator_id": 951}, {"position": 7, "door_status": "closed", "weight": 80, "elevator_id": 951}]
+    Then stats should count at least 2 more readings on floor 7
+    And stats should count at least 1 more door openings
+
+  Scenario: The series reports recent readings per bucket
+    When I POST batch payload [{"position": 2, "door_status": "closed", "weight": 10}, {"position": 3, "door_status": "closed", "weight": 20}]
+    And I request the stats series at resolution 60 with 2 points
+    Then response status should be 200
+    And the series should have 2 points with at least 2 readings in total
+
+  Scenario: An unsupported series resolution is rejected
+    When I request the stats series at resolution 7 with 10 points
+    Then response status should be 400
+    And response error should contain "resolution must be one of"
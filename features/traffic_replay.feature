@@ -0,0 +1,32 @@
+Feature: Traffic capture and replay
+
+  @mqtt
+  Scenario: A captured burst replayed as fast as possible reaches the cloud in order
+    Given a capture of 300 readings from 30 elevators
+    And I record current received count
+    When I replay the capture as fast as possible over 4 connections
+    Then each elevator's replayed readings should arrive in order
+    And cloud should have received at least 300 new messages within 10 seconds
+
+  @mqtt
+  Scenario: A running bridge flushes the traffic it captures
+    Given a separate bridge with CAPTURE_FILE={queue_dir}/traffic.evcap
+    When I publish 10 readings of elevator 984 to that bridge
+    Then that bridge's captures should hold 10 readings of elevator 984 within 5 seconds
+    And that bridge should have written 1 capture files
+
+  @mqtt
+  Scenario: Supervised workers capture to files of their own
+    Given a bridge supervisor with BRIDGE_WORKERS=2, CAPTURE_FILE={queue_dir}/traffic.evcap
+    When I publish 20 readings of elevator 985 to that bridge
+    Then every supervised worker should have forwarded readings within 5 seconds
+    And that bridge's captures should hold 20 readings of elevator 985 within 5 seconds
+    And that bridge should have written 2 capture files
+
+  @mqtt
+  Scenario: A capture replayed twice with renumbered seqs is stored twice
+    Given a capture of 300 readings from 30 elevators
+    And I record current received count
+    When I replay the capture as fast as possible over 4 connections with seq renumber
+    And I replay the capture as fast as possible over 4 connections with seq renumber
+    Then the cloud should have stored 600 replayed readings within 10 seconds
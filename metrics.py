@@ -0,0 +1,199 @@
+"""Lightweight in-process metrics with a Prometheus text endpoint.
+
+Only what the bridge needs: counters, gauges (set directly or computed at
+scrape time), fixed-bucket histograms and a log rate limiter so per-message
+log lines can't dominate CPU under load.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self):
+        yield self.name, self._value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn=None):
+        self.name = name
+        self.help = help_text
+        self._value = 0.0
+        self._fn = fn
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._fn() if self._fn is not None else self._value
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block."""
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            yield f'{self.name}_bucket{{le="{bound}"}}', cumulative
+        cumulative += counts[-1]
+        yield f'{self.name}_bucket{{le="+Inf"}}', cumulative
+        yield f"{self.name}_sum", total
+        yield f"{self.name}_count", cumulative
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name, help_text, fn=None):
+        return self._add(Gauge(name, help_text, fn))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in metric.samples():
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(registry, host, port, health=None):
+    """Serve ``/metrics`` (and ``/healthz`` if ``health`` is given) on a
+    daemon thread. ``health`` returns a JSON-serialisable status dict.
+
+    Returns the server, or None if the port could not be bound.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = registry.render().encode()
+                ctype = "text/plain; version=0.0.4"
+            elif self.path == "/healthz" and health is not None:
+                body = json.dumps(health()).encode()
+                ctype = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        logger.warning("Metrics server disabled, cannot bind %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class LogLimiter:
+    """Allow at most ``rate`` log lines per second for each message key.
+
+    Lines over the limit are counted, and the count is appended to the next
+    line that gets through.
+    """
+
+    def __init__(self, log, rate):
+        self.log = log
+        self.rate = rate
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def log_limited(self, level, msg, *args):
+        if self.rate <= 0:
+            self.log.log(level, msg, *args)
+            return
+        now = int(time.monotonic())
+        with self._lock:
+            window, count, suppressed = self._windows.get(msg, (now, 0, 0))
+            if window != now:
+                window, count = now, 0
+            if count >= self.rate:
+                self._windows[msg] = (window, count, suppressed + 1)
+                return
+            self._windows[msg] = (window, count + 1, 0)
+        if suppressed:
+            self.log.log(level, msg + " (%d similar suppressed)", *args, suppressed)
+        else:
+            self.log.log(level, msg, *args)
@@ -1,41 +1,299 @@
 from flask import Flask, request, jsonify
+import os
+import threading
 import time
 
+from command_dispatch import CommandDispatcher
+from telemetry_stats import SERIES_RESOLUTIONS, TelemetryStats
+from telemetry_store import Deduplicator, RingBuffer, SegmentStore
+from validation import validate_event, validate_reading
+
+# number of readings kept in memory; older ones are overwritten
+RETENTION = int(os.getenv("RETENTION", "100000"))
+# number of elevator events (errors, alarms) kept in memory
+EVENT_RETENTION = int(os.getenv("EVENT_RETENTION", "10000"))
+# directory for the durable store; unset keeps readings in memory only
+STORE_DIR = os.getenv("STORE_DIR")
+
 app = Flask(__name__)
 
-received_messages = []
-simulate_failure = {"down": False}
+durable_store = SegmentStore(STORE_DIR) if STORE_DIR else None
+# drops readings with an already seen (elevator_id, seq)
+dedup = Deduplicator()
+if durable_store is not None:
+    # Resume sequence numbers after a restart and warm the in-memory window
+    # with the most recent stored readings.
+    _recent = durable_store.range_by_seq(max(0, durable_store.next_seq - RETENTION))
+    received_messages = RingBuffer(RETENTION, start_seq=durable_store.next_seq - len(_recent))
+    for _rec in _recent:
+        received_messages.append(_rec["data"], _rec["ts"])
+        dedup.add(_rec["data"])
+else:
+    received_messages = RingBuffer(RETENTION)
+# guards ingestion and wakes requests waiting for new readings
+ingest_cond = threading.Condition()
+received_events = RingBuffer(EVENT_RETENTION)
+stats = TelemetryStats()
+commands = CommandDispatcher()
+# while "down", ingestion answers with "status" (500 unless a test asks for
+# e.g. 400 to have the API refuse everything)
+simulate_failure = {"down": False, "status": 500}
+
+def store_reading(data, ts):
+    """Record an accepted reading in the stats, in memory and, if enabled,
+    on disk."""
+    # one lock keeps the ring and the durable store on the same sequence;
+    # the stats go first, so a reading they can't take is not stored either
+    with ingest_cond:
+        stats.add(data, ts)
+        if durable_store is not None:
+            durable_store.append(data, ts)
+        received_messages.append(data, ts)
+        ingest_cond.notify_all()
+
+def store_reading_once(data, ts):
+    """store_reading for a reading just added to the dedup window; if it
+    can't be stored its seq is forgotten again, so the sender's retry is
+    stored instead of being answered as a duplicate."""
+    try:
+        store_reading(data, ts)
+    except Exception:
+        dedup.discard(data)
+        raise
 
 @app.route("/elevator-data", methods=["POST"])
 def receive_data():
     if simulate_failure["down"]:
-        return jsonify({"error": "Simulated failure"}), 500
+        return jsonify({"error": "Simulated failure"}), simulate_failure["status"]
 
     data = request.json
-    if not data or not all(k in data for k in ("position", "door_status", "weight")):
-        return jsonify({"error": "Missing fields"}), 400
+    error = validate_reading(data)
+    if error:
+        return jsonify({"error": error}), 400
+    if not dedup.add(data):
+        # already stored: acknowledge it so the sender stops retrying
+        return jsonify({"message": "Duplicate ignored", "duplicate": True}), 200
 
-    if not isinstance(data["position"], int) or not (1 <= data["position"] <= 10):
-        return jsonify({"error": "Invalid position"}), 400
+    store_reading_once(data, time.time())
+    return jsonify({"message": "Data received"}), 200
+
+@app.route("/elevator-data/batch", methods=["POST"])
+def receive_batch():
+    """Ingest a JSON list of readings, validating each one independently.
 
-    if data["door_status"] not in ["open", "closed"]:
-        return jsonify({"error": "Invalid door_status"}), 400
+    Returns 200 with a per-item ``results`` list (same order as the request);
+    invalid items are reported with status 400 and do not affect the others,
+    duplicates (seen ``elevator_id``/``seq``) with 200 and ``"duplicate": true``.
+    """
+    if simulate_failure["down"]:
+        return jsonify({"error": "Simulated failure"}), simulate_failure["status"]
 
-    if not isinstance(data["weight"], int) or not (0 <= data["weight"] <= 1000):
-        return jsonify({"error": "Invalid weight"}), 400
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({"error": "Expected a JSON list"}), 400
 
-    received_messages.append({"data": data, "ts": time.time()})
-    return jsonify({"message": "Data received"}), 200
+    # validate the whole batch before storing any of it, so a request that
+    # fails halfway leaves nothing stored or in the dedup window
+    errors = [validate_reading(data) for data in items]
+    results = []
+    now = time.time()
+    for data, error in zip(items, errors):
+        if error:
+            results.append({"status": 400, "error": error})
+        elif not dedup.add(data):
+            results.append({"status": 200, "duplicate": True})
+        else:
+            store_reading_once(data, now)
+            results.append({"status": 200})
+    accepted = sum(1 for r in results if r["status"] == 200 and not r.get("duplicate"))
+    rejected = sum(1 for r in results if r["status"] != 200)
+    return jsonify({"accepted": accepted, "rejected": rejected, "results": results}), 200
+
+@app.route("/elevator-events", methods=["POST"])
+def receive_event():
+    """Ingest one elevator event (error, alarm), forwarded by the bridge's
+    priority lane."""
+    if simulate_failure["down"]:
+        return jsonify({"error": "Simulated failure"}), simulate_failure["status"]
+
+    data = request.get_json(silent=True)
+    error = validate_event(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    received_events.append(data, time.time())
+    return jsonify({"message": "Event received"}), 200
+
+@app.route("/events", methods=["GET"])
+def get_events():
+    """Return retained events, oldest first; ``since``/``limit`` as for
+    /received."""
+    since = request.args.get("since", 0, type=int)
+    limit = request.args.get("limit", None, type=int)
+    return jsonify(received_events.range(since, 0, limit)), 200
 
 @app.route("/received", methods=["GET"])
 def get_received():
-    return jsonify(received_messages), 200
+    """Return retained readings, oldest first.
+
+    Optional query parameters: ``since`` (sequence number) or ``since_ts``
+    (unix timestamp) to start from, then ``offset`` and ``limit`` for
+    paging. Each item carries its ``seq``; pass the last one + 1 as the next
+    ``since`` to fetch only new readings.
+    """
+    args = request.args
+    try:
+        since = args.get("since", 0, type=int)
+        if "since_ts" in args:
+            since = max(since, received_messages.seq_for_ts(float(args["since_ts"])))
+        offset = args.get("offset", 0, type=int)
+        limit = args.get("limit", None, type=int)
+    except ValueError:
+        return jsonify({"error": "Invalid query parameter"}), 400
+    if offset < 0 or (limit is not None and limit < 0):
+        return jsonify({"error": "Invalid query parameter"}), 400
+    return jsonify(received_messages.range(since, offset, limit)), 200
+
+@app.route("/received/range", methods=["GET"])
+def get_received_range():
+    """Return readings with ``start <= ts <= end`` (unix timestamps).
+
+    Served from the durable store when STORE_DIR is set, so it covers the
+    full history rather than just the in-memory window.
+    """
+    try:
+        start = float(request.args["start"])
+        end = float(request.args["end"]) if "end" in request.args else None
+        limit = request.args.get("limit", None, type=int)
+    except (KeyError, ValueError):
+        return jsonify({"error": "start (and optional end) must be timestamps"}), 400
+    if limit is not None and limit < 0:
+        return jsonify({"error": "Invalid query parameter"}), 400
+    if durable_store is not None:
+        return jsonify(durable_store.range_by_ts(start, end, limit)), 200
+    items = received_messages.range(received_messages.seq_for_ts(start), limit=None)
+    if end is not None:
+        items = [item for item in items if item["ts"] <= end]
+    return jsonify(items[:limit]), 200
+
+@app.route("/received/count", methods=["GET"])
+def get_received_count():
+    """Total readings ingested, plus the retained sequence window and the
+    number of duplicate readings dropped.
+
+    With ``min_count`` the request is held until that many readings have
+    been ingested or ``wait`` seconds (default 10, max 30) have passed, so
+    clients can wait for data without polling.
+    """
+    min_count = request.args.get("min_count", None, type=int)
+    if min_count is not None:
+        wait = min(request.args.get("wait", 10.0, type=float), 30.0)
+        with ingest_cond:
+            ingest_cond.wait_for(lambda: received_messages.next_seq >= min_count, wait)
+    return jsonify({
+        "count": received_messages.next_seq,
+        "retained": len(received_messages),
+        "first_seq": received_messages.first_seq,
+        "duplicates": dedup.duplicates,
+    }), 200
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    """Per-floor, door-open and weight aggregates since the API started."""
+    return jsonify(stats.summary()), 200
+
+@app.route("/stats/series", methods=["GET"])
+def get_stats_series():
+    """Downsampled message rate and weight series.
+
+    ``resolution`` is the bucket width in seconds (one of
+    SERIES_RESOLUTIONS) and ``points`` the number of most recent buckets.
+    """
+    resolution = request.args.get("resolution", 10, type=int)
+    points = request.args.get("points", 60, type=int)
+    if resolution not in SERIES_RESOLUTIONS or points <= 0:
+        return jsonify({"error": f"resolution must be one of {list(SERIES_RESOLUTIONS)}"}), 400
+    return jsonify(stats.series_at(resolution, points, time.time())), 200
+
+def parse_command(item):
+    """Return ``(command, elevator_id)`` from a request item, or raise ValueError."""
+    if not isinstance(item, dict) or not isinstance(item.get("command"), str) or not item["command"]:
+        raise ValueError("command must be a non-empty string")
+    elevator_id = item.get("elevator_id")
+    if elevator_id is not None and (isinstance(elevator_id, bool) or not isinstance(elevator_id, int)):
+        raise ValueError("elevator_id must be an integer")
+    return item["command"], elevator_id
+
+def dispatch_and_wait(items, wait):
+    """Dispatch parsed ``items`` and optionally wait for their acks.
+
+    Returns the commands and the status to answer with: 202 if not waited
+    for, 504 if some ack didn't arrive in time. Raises OSError when the
+    broker can't be reached.
+    """
+    sent = [commands.dispatch(command, elevator_id) for command, elevator_id in items]
+    if not wait:
+        return sent, 202
+    return sent, 200 if commands.wait(sent, min(wait, 30.0)) else 504
+
+@app.route("/commands", methods=["POST"])
+def send_command():
+    """Send one command to the elevator (or to fleet elevator
+    ``elevator_id``) over MQTT with a correlation id, at QoS 1.
+
+    Body: ``{"command": "MOVE_TO_5", "elevator_id": 3, "wait": 2}``. With
+    ``wait`` the response is held until the simulator acks the command (200)
+    or ``wait`` seconds pass (504); without it the command is returned as
+    pending (202) and can be looked up by ``correlation_id``.
+    """
+    body = request.get_json(silent=True)
+    try:
+        item = parse_command(body)
+        wait = float(body.get("wait", 0))
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        sent, status = dispatch_and_wait([item], wait)
+    except OSError as e:
+        return jsonify({"error": f"MQTT broker unavailable: {e}"}), 503
+    return jsonify(sent[0].as_dict()), status
+
+@app.route("/commands/batch", methods=["POST"])
+def send_commands():
+    """Send many commands at once: ``{"commands": [{"command": ...,
+    "elevator_id": ...}, ...], "wait": 2}``. Results are in request order."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("commands"), list):
+        return jsonify({"error": "Expected {\"commands\": [...]}"}), 400
+    try:
+        items = [parse_command(item) for item in body["commands"]]
+        wait = float(body.get("wait", 0))
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        sent, status = dispatch_and_wait(items, wait)
+    except OSError as e:
+        return jsonify({"error": f"MQTT broker unavailable: {e}"}), 503
+    return jsonify({"commands": [cmd.as_dict() for cmd in sent]}), status
+
+@app.route("/commands/<correlation_id>", methods=["GET"])
+def get_command(correlation_id):
+    cmd = commands.get(correlation_id)
+    if cmd is None:
+        return jsonify({"error": "Unknown correlation_id"}), 404
+    return jsonify(cmd.as_dict()), 200
+
+@app.route("/commands/stats", methods=["GET"])
+def get_command_stats():
+    """Sent/acked/failed/pending counts and ack round-trip percentiles (ms)."""
+    return jsonify(commands.stats()), 200
 
 @app.route("/simulate_failure", methods=["POST"])
 def toggle_failure():
     payload = request.get_json(silent=True) or {}
     simulate_failure["down"] = bool(payload.get("down", False))
-    return jsonify({"down": simulate_failure["down"]}), 200
+    simulate_failure["status"] = int(payload.get("status", 500))
+    return jsonify(simulate_failure), 200
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    app.run(debug=True, port=int(os.getenv("API_PORT", "5000")))
\ No newline at end of file
@@ -1,13 +1,49 @@
 import time
 import json
+import os
+import heapq
+import itertools
 import paho.mqtt.client as mqtt
 import random
+import socket
+import threading
+from array import array
 
-BROKER = "localhost"
-PORT = 1883
-TOPIC_DATA = "elevator/sensor_data"
-TOPIC_COMMAND = "elevator/command"
-TOPIC_EVENTS = "elevator/events"
+BROKER = os.getenv("MQTT_BROKER", "localhost")
+PORT = int(os.getenv("MQTT_PORT", "1883"))
+# prepended to every topic, so several setups can share one broker
+TOPIC_PREFIX = os.getenv("TOPIC_PREFIX", "")
+TOPIC_DATA = TOPIC_PREFIX + "elevator/sensor_data"
+TOPIC_COMMAND = TOPIC_PREFIX + "elevator/command"
+TOPIC_EVENTS = TOPIC_PREFIX + "elevator/events"
+# commands sent as {"command": ..., "correlation_id": ...} are acknowledged
+# here (see command_dispatch.py); plain-text commands are not
+TOPIC_ACKS = TOPIC_PREFIX + "elevator/acks"
+
+# Fleet mode: FLEET_SIZE > 0 simulates that many elevators in this process,
+# each on its own topics (elevator/<id>/sensor_data, .../command, .../events,
+# .../acks).
+FLEET_SIZE = int(os.getenv("FLEET_SIZE", "0"))
+FLEET_TOPIC = TOPIC_PREFIX + "elevator/{}/{}"
+# State changes are published as soon as a command is applied; on top of
+# that the full state is re-published every HEARTBEAT_INTERVAL seconds
+# (0 disables the heartbeat) and on every (re)connect.
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "5.0"))
+# publish only the changed fields (plus "delta": true) on a state change;
+# heartbeats always carry the full state
+DELTA_ONLY = os.getenv("DELTA_ONLY", "").lower() in ("1", "true", "yes")
+# each elevator's heartbeat interval varies by +/- this fraction
+PUBLISH_JITTER = float(os.getenv("PUBLISH_JITTER", "0.0"))
+# every BURST_EVERY seconds each elevator publishes BURST_SIZE extra readings
+BURST_SIZE = int(os.getenv("BURST_SIZE", "0"))
+BURST_EVERY = float(os.getenv("BURST_EVERY", "0"))
+# Every reading carries a per-elevator "seq" so the API can drop readings
+# delivered twice. Numbering starts at the boot time in milliseconds, so a
+# restarted simulator keeps counting up instead of reusing numbers.
+SEQ_START = int(time.time() * 1000)
+# QoS of readings and events; 1 lets the broker queue them for a bridge
+# with a persistent session (DURABLE_INTAKE) while it is down
+PUBLISH_QOS = int(os.getenv("PUBLISH_QOS", "0"))
 
 elevator_state = {
     "position": 1,
@@ -15,63 +51,298 @@ elevator_state = {
     "weight": 0,
     "maintenance_mode": False
 }
+# held while the state is changed or published, so a state change and a
+# heartbeat can't interleave
+state_lock = threading.Lock()
+sequence = itertools.count(SEQ_START)
+STATE_FIELDS = ("position", "door_status", "maintenance_mode")
 
-def publish_error(client, command, error_message):
+def publish_error(client, command, error_message, topic=TOPIC_EVENTS):
     payload = json.dumps({
         "type": "error",
         "error": error_message,
         "command": command,
         "ts": time.time()
     })
-    client.publish(TOPIC_EVENTS, payload)
+    client.publish(topic, payload, qos=PUBLISH_QOS)
 
-def on_message(client, userdata, message):
-    command = message.payload.decode()
+def parse_command(payload):
+    """Return ``(command, correlation_id)`` for a raw command payload."""
+    text = payload.decode()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+            return str(data["command"]), data.get("correlation_id")
+        except (ValueError, KeyError, TypeError):
+            pass
+    return text, None
+
+def publish_ack(client, correlation_id, command, error, topic=TOPIC_ACKS):
+    if correlation_id is None:
+        return
+    ack = {
+        "correlation_id": correlation_id,
+        "command": command,
+        "status": "error" if error else "ok",
+        "ts": time.time(),
+    }
+    if error:
+        ack["error"] = error
+    client.publish(topic, json.dumps(ack), qos=1)
+
+def apply_command(state, command):
+    """Apply ``command`` to an elevator ``state`` mapping.
+
+    Returns an error message when the command is rejected, otherwise None.
+    """
     if command == "MAINTENANCE_ON":
-        elevator_state["maintenance_mode"] = True
+        state["maintenance_mode"] = True
         print("Elevator entered maintenance mode.")
     elif command == "MAINTENANCE_OFF":
-        elevator_state["maintenance_mode"] = False
+        state["maintenance_mode"] = False
         print("Elevator exited maintenance mode.")
     elif command == "OPEN_DOOR":
-        elevator_state["door_status"] = "open"
+        state["door_status"] = "open"
         print("Door opened.")
     elif command == "CLOSE_DOOR":
-        elevator_state["door_status"] = "closed"
+        state["door_status"] = "closed"
         print("Door closed.")
     elif command.startswith("MOVE_TO_"):
-        if elevator_state.get("maintenance_mode"):
+        if state.get("maintenance_mode"):
             err = "Elevator is in maintenance mode; MOVE_TO commands are not allowed."
             print(f"Error: {err}")
-            publish_error(client, command, err)
-            return
+            return err
         try:
             floor = int(command.split("_")[-1])
             if floor < 1 or floor > 10:
                 err = f"The 'MOVE_TO_' command only supports floors between 1 and 10. Command received: {floor}"
                 print(f"Error: {err}")
-                publish_error(client, command, err)
-            else:
-                print(f"Moving elevator to floor {floor}.")
-                elevator_state["position"] = floor
+                return err
+            print(f"Moving elevator to floor {floor}.")
+            state["position"] = floor
         except ValueError:
             err = "Invalid floor value in 'MOVE_TO_' command."
             print(f"Error: {err}")
-            publish_error(client, command, err)
+            return err
     else:
         err = "Unknown command received"
         print(err)
-        publish_error(client, command, err)
+        return err
+    return None
 
-client = mqtt.Client()
-client.on_message = on_message
-client.connect(BROKER, PORT)
-client.subscribe(TOPIC_COMMAND)
-client.loop_start()
+def apply_and_diff(state, command):
+    """Apply ``command`` and return ``(error, changed fields)``."""
+    before = [state[field] for field in STATE_FIELDS]
+    err = apply_command(state, command)
+    changed = {
+        field: state[field]
+        for field, old in zip(STATE_FIELDS, before)
+        if state[field] != old
+    }
+    return err, changed
 
-while True:
-    elevator_state["weight"] = random.randint(0, 300)
-    payload = json.dumps(elevator_state)
-    client.publish(TOPIC_DATA, payload)
+def publish_state(client):
+    """Publish the full state, with a fresh weight reading."""
+    with state_lock:
+        elevator_state["weight"] = random.randint(0, 300)
+        payload = json.dumps(dict(elevator_state, seq=next(sequence)))
+        client.publish(TOPIC_DATA, payload, qos=PUBLISH_QOS)
     print(f"Data sent: {payload}")
-    time.sleep(5)
\ No newline at end of file
+
+def on_connect(client, userdata, flags, rc):
+    # (re)subscribe, and publish the full state right away: with DELTA_ONLY
+    # and no heartbeat it is the only base the bridge gets to expand deltas
+    if rc == 0:
+        client.subscribe(TOPIC_COMMAND, qos=1)
+        publish_state(client)
+
+def on_message(client, userdata, message):
+    command, correlation_id = parse_command(message.payload)
+    with state_lock:
+        err, changed = apply_and_diff(elevator_state, command)
+        if changed:
+            if DELTA_ONLY:
+                payload = json.dumps(dict(changed, delta=True, seq=next(sequence)))
+            else:
+                payload = json.dumps(dict(elevator_state, seq=next(sequence)))
+            client.publish(TOPIC_DATA, payload, qos=PUBLISH_QOS)
+            print(f"State change sent: {payload}")
+    if err:
+        publish_error(client, command, err)
+    publish_ack(client, correlation_id, command, err)
+
+
+class Fleet:
+    """Array-backed state for many elevators, one slot per elevator id."""
+
+    PAYLOAD = '{"position":%d,"door_status":"%s","weight":%d,"maintenance_mode":%s,"elevator_id":%d,"seq":%d}'
+
+    def __init__(self, size):
+        self.size = size
+        self.position = array("B", [1]) * size
+        self.door_open = array("B", [0]) * size
+        self.maintenance = array("B", [0]) * size
+        self.seq = array("Q", [SEQ_START]) * size
+
+    def next_seq(self, i):
+        # callers hold state_lock: heartbeats and command replies number
+        # readings from two threads
+        seq = self.seq[i]
+        self.seq[i] = seq + 1
+        return seq
+
+    def topic(self, i):
+        return FLEET_TOPIC.format(i + 1, "sensor_data")
+
+    def on_connect(self, client, userdata, flags, rc):
+        # as for a single elevator: every elevator's full state on connect
+        if rc == 0:
+            client.subscribe(FLEET_TOPIC.format("+", "command"), qos=1)
+            for i in range(self.size):
+                client.publish(self.topic(i), self.payload(i), qos=PUBLISH_QOS)
+
+    def payload(self, i):
+        """Full state of elevator ``i``, read under state_lock."""
+        with state_lock:
+            return self._payload(i)
+
+    def _payload(self, i):
+        return self.PAYLOAD % (
+            self.position[i],
+            "open" if self.door_open[i] else "closed",
+            random.randint(0, 300),
+            "true" if self.maintenance[i] else "false",
+            i + 1,
+            self.next_seq(i),
+        )
+
+    def on_message(self, client, userdata, message):
+        # topic: [prefix]elevator/<id>/command, ids are 1-based
+        try:
+            i = int(message.topic.split("/")[-2]) - 1
+        except (IndexError, ValueError):
+            return
+        if not 0 <= i < self.size:
+            return
+        command, correlation_id = parse_command(message.payload)
+        # the heartbeat thread reads the same arrays
+        with state_lock:
+            err, changed = apply_and_diff(_FleetElevator(self, i), command)
+            if changed:
+                if DELTA_ONLY:
+                    payload = json.dumps(dict(changed, elevator_id=i + 1, delta=True, seq=self.next_seq(i)))
+                else:
+                    payload = self._payload(i)
+                client.publish(self.topic(i), payload, qos=PUBLISH_QOS)
+        if err:
+            publish_error(client, command, err, FLEET_TOPIC.format(i + 1, "events"))
+        publish_ack(client, correlation_id, command, err, FLEET_TOPIC.format(i + 1, "acks"))
+
+
+class _FleetElevator:
+    """Mapping view of one fleet slot, so apply_command can update it."""
+
+    def __init__(self, fleet, i):
+        self.fleet = fleet
+        self.i = i
+
+    def __getitem__(self, key):
+        if key == "position":
+            return self.fleet.position[self.i]
+        if key == "door_status":
+            return "open" if self.fleet.door_open[self.i] else "closed"
+        if key == "maintenance_mode":
+            return bool(self.fleet.maintenance[self.i])
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key == "position":
+            self.fleet.position[self.i] = value
+        elif key == "door_status":
+            self.fleet.door_open[self.i] = value == "open"
+        elif key == "maintenance_mode":
+            self.fleet.maintenance[self.i] = bool(value)
+        else:
+            raise KeyError(key)
+
+
+def run_single(client):
+    if HEARTBEAT_INTERVAL <= 0:
+        # no heartbeat: only state changes (and the state on connect) are
+        # published, from the MQTT callbacks
+        threading.Event().wait()
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        publish_state(client)
+
+def run_fleet(client, fleet):
+    size = fleet.size
+    topics = [fleet.topic(i) for i in range(size)]
+
+    # Min-heap of (next heartbeat time, elevator index). Start times are
+    # spread over one interval so the fleet doesn't publish in lockstep.
+    now = time.monotonic()
+    schedule = []
+    if HEARTBEAT_INTERVAL > 0:
+        schedule = [(now + random.uniform(0, HEARTBEAT_INTERVAL), i) for i in range(size)]
+        heapq.heapify(schedule)
+    next_burst = now + BURST_EVERY if BURST_SIZE and BURST_EVERY else float("inf")
+    sent = 0
+    report_at = now + 10
+    print(f"Simulating {size} elevators, heartbeat every {HEARTBEAT_INTERVAL}s (jitter {PUBLISH_JITTER:.0%})")
+
+    while True:
+        now = time.monotonic()
+        if now >= next_burst:
+            for i in range(size):
+                for _ in range(BURST_SIZE):
+                    client.publish(topics[i], fleet.payload(i), qos=PUBLISH_QOS)
+            sent += size * BURST_SIZE
+            next_burst += BURST_EVERY
+            now = time.monotonic()
+        if now >= report_at:
+            print(f"Published {sent} readings ({sent / 10:.0f}/s)")
+            sent = 0
+            report_at = now + 10
+        due, i = schedule[0] if schedule else (float("inf"), None)
+        if due > now:
+            # bursts that fell behind are due already: don't sleep at all
+            time.sleep(max(0.0, min(due, next_burst, report_at) - now))
+            continue
+        client.publish(topics[i], fleet.payload(i), qos=PUBLISH_QOS)
+        sent += 1
+        # schedule from the previous due time so a slow loop catches up
+        # instead of drifting
+        interval = HEARTBEAT_INTERVAL * (1 + random.uniform(-PUBLISH_JITTER, PUBLISH_JITTER))
+        heapq.heapreplace(schedule, (due + interval, i))
+
+def set_nodelay(client, userdata, sock):
+    # a command's PUBACK, state change and ack go out back to back; don't
+    # let Nagle's algorithm hold them for the broker's delayed ACK
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+def main():
+    client = mqtt.Client()
+    client.on_socket_open = set_nodelay
+    fleet = Fleet(FLEET_SIZE) if FLEET_SIZE > 0 else None
+    if fleet is not None:
+        client.on_connect = fleet.on_connect
+        client.on_message = fleet.on_message
+    else:
+        client.on_connect = on_connect
+        client.on_message = on_message
+    client.connect(BROKER, PORT)
+    client.loop_start()
+    if fleet is not None:
+        run_fleet(client, fleet)
+    else:
+        run_single(client)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""Minimal MQTT 3.1.1 broker stand-in for local benchmarks and tests.
+
+It implements just enough of the protocol for the components in this repo
+(paho-mqtt clients publishing and subscribing with QoS 0/1, ``+``/``#``
+wildcards, ``$share/<group>/`` shared subscriptions and persistent sessions:
+a client connecting with clean_session=0 gets its subscriptions back, QoS 1
+messages it had not acknowledged are redelivered and those published while
+it was away are queued for it, in memory). It is not meant to replace
+Mosquitto in a real deployment.
+
+Run standalone with ``python3 mqtt_broker.py`` or embed it with::
+
+    broker = Broker(port=0)
+    broker.start()   # blocks until the listening socket is bound
+    ...              # broker.port holds the actual port
+    broker.wait_for_subscriber("elevator/command")  # a component is ready
+    broker.stop()
+"""
+import asyncio
+import collections
+import logging
+import os
+import threading
+
+BROKER_HOST = os.getenv("BROKER_HOST", "127.0.0.1")
+BROKER_PORT = int(os.getenv("BROKER_PORT", "1883"))
+# QoS 1 messages queued per disconnected persistent session; older ones are
+# dropped beyond that
+MAX_QUEUED = int(os.getenv("BROKER_MAX_QUEUED", "100000"))
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+logger = logging.getLogger("mqtt_broker")
+
+
+def topic_matches(topic_filter, topic):
+    """Return True when ``topic`` matches an MQTT ``topic_filter``."""
+    f_parts = topic_filter.split("/")
+    t_parts = topic.split("/")
+    for i, part in enumerate(f_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts):
+            return False
+        if part != "+" and part != t_parts[i]:
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+def split_shared(topic_filter):
+    """Split ``$share/<group>/<filter>`` into ``(group, filter)``."""
+    if topic_filter.startswith("$share/"):
+        _, group, rest = topic_filter.split("/", 2)
+        return group, rest
+    return None, topic_filter
+
+
+def _encode_length(n):
+    out = bytearray()
+    while True:
+        byte = n % 128
+        n //= 128
+        if n:
+            byte |= 0x80
+        out.append(byte)
+        if not n:
+            return bytes(out)
+
+
+def _packet(ptype, flags, body):
+    return bytes([(ptype << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _utf8(s):
+    data = s.encode()
+    return len(data).to_bytes(2, "big") + data
+
+
+class _Session:
+    def __init__(self, client_id, writer, clean=True):
+        self.client_id = client_id
+        self.writer = writer  # None while a persistent session is offline
+        self.clean = clean
+        self.subscriptions = {}  # filter -> granted qos
+        self.inflight = collections.OrderedDict()  # mid -> (topic, payload), awaiting PUBACK
+        self.queued = collections.deque(maxlen=MAX_QUEUED)  # (topic, payload) while offline
+        self._next_mid = 0
+
+    @property
+    def online(self):
+        return self.writer is not None
+
+    def next_mid(self):
+        self._next_mid = self._next_mid % 65535 + 1
+        return self._next_mid
+
+    def send(self, data):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class Broker:
+    """asyncio MQTT broker running on a background thread."""
+
+    def __init__(self, host=BROKER_HOST, port=BROKER_PORT):
+        self.host = host
+        self.port = port
+        self.sessions = {}
+        self._share_rr = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._subscribed = threading.Condition()
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self, timeout=5.0):
+        self._thread = threading.Thread(target=self._run, name="mqtt-broker", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError("MQTT broker did not start within %.1fs" % timeout)
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        self._thread.join(timeout=5)
+
+    async def _shutdown(self):
+        # close client connections and let their handlers finish before the
+        # loop goes away
+        self._server.close()
+        for sess in list(self.sessions.values()):
+            if sess.writer is not None:
+                sess.writer.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=1.0)
+        self._loop.stop()
+
+    def wait_for_subscriber(self, topic, timeout=5.0):
+        """Block until some client is subscribed to a filter matching
+        ``topic``; return False on timeout."""
+        with self._subscribed:
+            return self._subscribed.wait_for(lambda: self._has_subscriber(topic), timeout)
+
+    def _has_subscriber(self, topic):
+        for sess in list(self.sessions.values()):
+            if not sess.online:
+                continue
+            for topic_filter in list(sess.subscriptions):
+                if topic_matches(split_shared(topic_filter)[1], topic):
+                    return True
+        return False
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("MQTT broker listening on %s:%s", self.host, self.port)
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop.close()
+
+    # -- protocol ----------------------------------------------------------
+
+    async def _read_packet(self, reader):
+        header = await reader.readexactly(1)
+        length, mult = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * mult
+            if not byte & 0x80:
+                break
+            mult *= 128
+        body = await reader.readexactly(length) if length else b""
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    async def _handle(self, reader, writer):
+        session = None
+        try:
+            ptype, _, body = await self._read_packet(reader)
+            if ptype != CONNECT:
+                return
+            session = self._on_connect(body, writer)
+            while True:
+                ptype, flags, body = await self._read_packet(reader)
+                if ptype == PUBLISH:
+                    self._on_publish(session, flags, body)
+                elif ptype == SUBSCRIBE:
+                    self._on_subscribe(session, body)
+                elif ptype == UNSUBSCRIBE:
+                    mid = body[:2]
+                    pos = 2
+                    while pos < len(body):
+                        n = int.from_bytes(body[pos:pos + 2], "big")
+                        session.subscriptions.pop(body[pos + 2:pos + 2 + n].decode(), None)
+                        pos += 2 + n
+                    session.send(_packet(UNSUBACK, 0, mid))
+                elif ptype == PUBACK:
+                    session.inflight.pop(int.from_bytes(body[:2], "big"), None)
+                elif ptype == PUBREL:
+                    session.send(_packet(PUBCOMP, 0, body[:2]))
+                elif ptype == PINGREQ:
+                    session.send(_packet(PINGRESP, 0, b""))
+                elif ptype == DISCONNECT:
+                    break
+                # PUBREC/PUBCOMP from clients need no bookkeeping here.
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if session is not None and session.writer is writer:
+                if session.clean:
+                    if self.sessions.get(session.client_id) is session:
+                        del self.sessions[session.client_id]
+                else:
+                    session.writer = None
+            writer.close()
+
+    def _on_connect(self, body, writer):
+        pos = 2 + int.from_bytes(body[0:2], "big")  # protocol name
+        pos += 1  # protocol level
+        clean = bool(body[pos] & 0x02)
+        pos += 1  # connect flags
+        pos += 2  # keepalive
+        n = int.from_bytes(body[pos:pos + 2], "big")
+        client_id = body[pos + 2:pos + 2 + n].decode() or "anon-%d" % id(writer)
+        old = self.sessions.get(client_id)
+        if old is not None and old.writer is not None:
+            old.writer.close()
+        if old is not None and not clean and not old.clean:
+            # resume: the session keeps its subscriptions and messages
+            session = old
+            session.writer = writer
+            session.send(_packet(CONNACK, 0, b"\x01\x00"))
+            for mid, (topic, payload) in session.inflight.items():
+                session.send(_packet(PUBLISH, 0x08 | 1 << 1, _utf8(topic) + mid.to_bytes(2, "big") + payload))
+            while session.queued:
+                self._deliver(session, *session.queued.popleft(), 1)
+            return session
+        session = _Session(client_id, writer, clean)
+        self.sessions[client_id] = session
+        session.send(_packet(CONNACK, 0, b"\x00\x00"))
+        return session
+
+    def _on_subscribe(self, session, body):
+        mid = body[:2]
+        pos = 2
+        granted = bytearray()
+        while pos < len(body):
+            n = int.from_bytes(body[pos:pos + 2], "big")
+            topic_filter = body[pos + 2:pos + 2 + n].decode()
+            qos = min(body[pos + 2 + n] & 0x03, 1)
+            pos += 3 + n
+            session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+        session.send(_packet(SUBACK, 0, mid + bytes(granted)))
+        with self._subscribed:
+            self._subscribed.notify_all()
+
+    def _on_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        n = int.from_bytes(body[0:2], "big")
+        topic = body[2:2 + n].decode()
+        pos = 2 + n
+        if qos:
+            mid = body[pos:pos + 2]
+            pos += 2
+            session.send(_packet(PUBACK if qos == 1 else PUBREC, 0, mid))
+        self.route(topic, body[pos:], qos)
+
+    def route(self, topic, payload, qos=0):
+        """Deliver ``payload`` to every session subscribed to ``topic``."""
+        shared = {}
+        for sess in list(self.sessions.values()):
+            if not sess.online and not qos:
+                continue
+            best = None
+            for topic_filter, sub_qos in sess.subscriptions.items():
+                group, plain = split_shared(topic_filter)
+                if not topic_matches(plain, topic):
+                    continue
+                if group is not None:
+                    shared.setdefault((group, plain), []).append((sess, sub_qos))
+                else:
+                    best = max(best or 0, sub_qos)
+            if best is not None:
+                self._deliver(sess, topic, payload, min(qos, best))
+        for key, members in shared.items():
+            # prefer connected members; queue for an offline one only if
+            # no member is connected
+            members = [m for m in members if m[0].online] or members
+            idx = self._share_rr.get(key, 0) % len(members)
+            self._share_rr[key] = idx + 1
+            sess, sub_qos = members[idx]
+            self._deliver(sess, topic, payload, min(qos, sub_qos))
+
+    def _deliver(self, session, topic, payload, qos):
+        if not session.online:
+            if qos:
+                session.queued.append((topic, payload))
+            return
+        body = _utf8(topic)
+        if qos:
+            mid = session.next_mid()
+            session.inflight[mid] = (topic, payload)
+            body += mid.to_bytes(2, "big")
+        session.send(_packet(PUBLISH, qos << 1, body + payload))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [broker] %(levelname)s: %(message)s")
+    broker = Broker().start()
+    try:
+        broker._thread.join()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Run the behave suite on several workers, each with its own topology.
+
+Feature files are split into one group per worker (balanced by scenario
+count) and every group runs in its own behave process with its own API
+port, topic prefix, queue directory and log directory, so workers can
+share one MQTT broker without seeing each other's traffic::
+
+    python3 run_parallel.py                    # one worker per core
+    python3 run_parallel.py -j 4 -- --tags=@mqtt
+    TEST_MODE=inprocess python3 run_parallel.py
+
+Arguments after ``--`` are passed to every behave process.
+"""
+import argparse
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FEATURES_DIR = os.path.join(HERE, "features")
+
+# the steps' port picker stays clear of the ephemeral range, so a worker's
+# API port can't be taken by an outgoing connection before it binds
+sys.path.insert(0, os.path.join(FEATURES_DIR, "steps"))
+from bridge_steps import free_port  # noqa: E402
+
+
+def scenario_count(path):
+    """Scenarios in a feature file, counting each Examples row."""
+    count = 0
+    in_examples = False
+    header_seen = False
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(("Scenario:", "Scenario Outline:", "Examples:")):
+                in_examples = line.startswith("Examples:")
+                header_seen = False
+                if line.startswith("Scenario:"):
+                    count += 1
+            elif in_examples and line.startswith("|"):
+                if header_seen:
+                    count += 1
+                header_seen = True
+    return count
+
+
+def partition(features, workers):
+    """Greedy longest-first split of ``features`` into ``workers`` groups."""
+    groups = [[] for _ in range(workers)]
+    loads = [0] * workers
+    for path in sorted(features, key=scenario_count, reverse=True):
+        i = loads.index(min(loads))
+        groups[i].append(path)
+        loads[i] += scenario_count(path)
+    return [g for g in groups if g]
+
+
+def worker_env(i):
+    env = os.environ.copy()
+    env.update({
+        "API_PORT": str(free_port()),
+        "TOPIC_PREFIX": f"test/w{i}/",
+        "QUEUE_DIR": f"/tmp/bridge_queue_w{i}",
+        "LOG_DIR": os.path.join("logs", f"w{i}"),
+        "METRICS_PORT": "0",
+    })
+    return env
+
+
+# behave's closing "N features passed, M failed, ..." lines
+SUMMARY = re.compile(r"^\d+ (features?|scenarios?|steps?) passed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of workers")
+    parser.add_argument("behave_args", nargs="*", help="extra behave arguments (after --)")
+    args = parser.parse_args()
+
+    features = glob.glob(os.path.join(FEATURES_DIR, "*.feature"))
+    groups = partition(features, max(1, args.jobs))
+    os.makedirs("logs", exist_ok=True)
+
+    start = time.monotonic()
+    procs = []
+    for i, group in enumerate(groups):
+        env = worker_env(i)
+        shutil.rmtree(env["QUEUE_DIR"], ignore_errors=True)
+        os.makedirs(env["LOG_DIR"], exist_ok=True)
+        out = open(os.path.join(env["LOG_DIR"], "behave.log"), "w")
+        cmd = [sys.executable, "-m", "behave", *args.behave_args, *group]
+        procs.append((i, group, subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT, env=env, cwd=HERE), out))
+    print(f"Running {len(features)} features on {len(procs)} workers")
+
+    failed = []
+    for i, group, proc, out in procs:
+        code = proc.wait()
+        out.close()
+        names = ", ".join(os.path.basename(p) for p in group)
+        status = "ok" if code == 0 else f"FAILED (exit {code})"
+        print(f"worker {i}: {status} — {names}")
+        with open(out.name) as f:
+            for line in f:
+                if SUMMARY.match(line):
+                    print(f"  {line.rstrip()}")
+        if code != 0:
+            failed.append(i)
+    print(f"Finished in {time.monotonic() - start:.1f}s")
+    if failed:
+        print("See logs/w<n>/behave.log for the failing workers' output")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
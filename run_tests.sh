@@ -1,8 +1,9 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
-# quick pre-check for MQTT broker (port 1883) on localhost
-if ! ss -ltn | grep -q ':1883'; then
+# quick pre-check for MQTT broker (port 1883) on localhost; TEST_MODE=inprocess
+# uses the embedded broker stand-in instead
+if [ "${TEST_MODE:-}" != "inprocess" ] && ! ss -ltn | grep -q ':1883'; then
   echo "MQTT broker not detected on localhost:1883"
   echo "Please start Mosquitto, for example:"
   echo "  sudo apt-get install -y mosquitto mosquitto-clients && sudo systemctl enable --now mosquitto"
@@ -0,0 +1,147 @@
+"""Running aggregates over readings received by the mock cloud API.
+
+Every statistic is updated incrementally on ingest and kept in fixed-size
+``array`` buffers, so a query costs the same no matter how many readings
+have been received.
+"""
+import threading
+from array import array
+
+FLOORS = 10
+WEIGHT_BUCKET = 50  # kg per weight histogram bucket
+MAX_WEIGHT = 1000
+SERIES_RESOLUTIONS = (1, 10, 60)  # seconds per bucket
+SERIES_BUCKETS = 3600  # buckets kept per resolution
+
+
+class _Series:
+    """Ring of time buckets at one resolution (count, weight sum/min/max)."""
+
+    def __init__(self, resolution, size):
+        self.resolution = resolution
+        self.size = size
+        self.bucket_ids = array("q", [-1]) * size
+        self.count = array("Q", [0]) * size
+        self.weight_sum = array("Q", [0]) * size
+        self.weight_min = array("H", [0]) * size
+        self.weight_max = array("H", [0]) * size
+
+    def add(self, ts, weight):
+        bucket = int(ts // self.resolution)
+        i = bucket % self.size
+        if self.bucket_ids[i] != bucket:
+            # slot still holds an older bucket: recycle it
+            self.bucket_ids[i] = bucket
+            self.count[i] = 0
+            self.weight_sum[i] = 0
+            self.weight_min[i] = weight
+            self.weight_max[i] = weight
+        self.count[i] += 1
+        self.weight_sum[i] += weight
+        self.weight_min[i] = min(self.weight_min[i], weight)
+        self.weight_max[i] = max(self.weight_max[i], weight)
+
+    def last(self, now, points):
+        """Return the ``points`` most recent buckets up to ``now``, oldest first."""
+        end = int(now // self.resolution)
+        out = []
+        for bucket in range(end - min(points, self.size) + 1, end + 1):
+            i = bucket % self.size
+            if self.bucket_ids[i] != bucket or not self.count[i]:
+                out.append({"ts": bucket * self.resolution, "count": 0, "rate": 0.0})
+                continue
+            n = self.count[i]
+            out.append({
+                "ts": bucket * self.resolution,
+                "count": n,
+                "rate": n / self.resolution,
+                "avg_weight": self.weight_sum[i] / n,
+                "min_weight": self.weight_min[i],
+                "max_weight": self.weight_max[i],
+            })
+        return out
+
+
+class TelemetryStats:
+    """Per-floor, door, weight and time-bucketed aggregates."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.floor_count = array("Q", [0]) * (FLOORS + 1)
+        self.floor_weight = array("Q", [0]) * (FLOORS + 1)
+        self.floor_seconds = array("d", [0.0]) * (FLOORS + 1)
+        self.weight_hist = array("Q", [0]) * (MAX_WEIGHT // WEIGHT_BUCKET + 1)
+        self.door_openings = 0
+        self.door_open_seconds = 0.0
+        self.door_open_max = 0.0
+        self.series = {res: _Series(res, SERIES_BUCKETS) for res in SERIES_RESOLUTIONS}
+        # per elevator: (position, door_status, ts of last reading, door opened at)
+        self._last = {}
+
+    def add(self, data, ts):
+        """Fold one validated reading into the aggregates.
+
+        Raises before changing anything if the reading can't be folded in
+        (e.g. an unhashable ``elevator_id``), so callers can update the
+        stats ahead of storing the reading.
+        """
+        position = data["position"]
+        weight = data["weight"]
+        door = data["door_status"]
+        key = data.get("elevator_id")
+        with self._lock:
+            last = self._last.get(key)
+            self.total += 1
+            self.floor_count[position] += 1
+            self.floor_weight[position] += weight
+            self.weight_hist[weight // WEIGHT_BUCKET] += 1
+            for series in self.series.values():
+                series.add(ts, weight)
+
+            opened_at = None
+            if last is not None:
+                last_position, last_door, last_ts, opened_at = last
+                # time between two readings is credited to the floor the
+                # elevator was reported at by the earlier one
+                self.floor_seconds[last_position] += max(0.0, ts - last_ts)
+                if last_door == "open" and door == "closed" and opened_at is not None:
+                    duration = max(0.0, ts - opened_at)
+                    self.door_openings += 1
+                    self.door_open_seconds += duration
+                    self.door_open_max = max(self.door_open_max, duration)
+                    opened_at = None
+            if door == "open" and opened_at is None:
+                opened_at = ts
+            self._last[key] = (position, door, ts, opened_at)
+
+    def summary(self):
+        with self._lock:
+            floors = {}
+            for floor in range(1, FLOORS + 1):
+                n = self.floor_count[floor]
+                floors[floor] = {
+                    "count": n,
+                    "avg_weight": self.floor_weight[floor] / n if n else None,
+                    "seconds": self.floor_seconds[floor],
+                }
+            return {
+                "total": self.total,
+                "floors": floors,
+                "weight_histogram": {
+                    "bucket_kg": WEIGHT_BUCKET,
+                    "counts": list(self.weight_hist),
+                },
+                "door": {
+                    "openings": self.door_openings,
+                    "total_open_seconds": self.door_open_seconds,
+                    "avg_open_seconds": (
+                        self.door_open_seconds / self.door_openings if self.door_openings else None
+                    ),
+                    "max_open_seconds": self.door_open_max,
+                },
+            }
+
+    def series_at(self, resolution, points, now):
+        with self._lock:
+            return self.series[resolution].last(now, points)
@@ -0,0 +1,347 @@
+"""Storage for readings received by the mock cloud API."""
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+
+STORE_SEGMENT_BYTES = int(os.getenv("STORE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+STORE_INDEX_INTERVAL = int(os.getenv("STORE_INDEX_INTERVAL", "256"))
+# sequence numbers remembered per elevator for duplicate detection
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "4096"))
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+RECORD_HEADER = struct.Struct("<QdI")  # seq, ts, body length
+INDEX_ENTRY = struct.Struct("<QdQ")  # seq, ts, byte position
+
+
+class RingBuffer:
+    """Fixed-capacity, in-memory store of readings.
+
+    Every record gets a monotonically increasing sequence number. Once
+    ``capacity`` records are held the oldest one is overwritten, so memory
+    stays bounded while sequence numbers keep counting everything ingested.
+    Lookups by sequence number are O(1); lookups by timestamp are a binary
+    search over the retained window.
+    """
+
+    def __init__(self, capacity, start_seq=0):
+        self.capacity = capacity
+        self._items = [None] * capacity
+        self._next_seq = start_seq
+        self._start_seq = start_seq
+        self._last_ts = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._next_seq - self.first_seq
+
+    @property
+    def first_seq(self):
+        """Sequence number of the oldest retained record."""
+        return max(self._start_seq, self._next_seq - self.capacity)
+
+    @property
+    def next_seq(self):
+        """Sequence number the next record will get (= total ingested)."""
+        return self._next_seq
+
+    def append(self, data, ts):
+        with self._lock:
+            # callers read the clock before taking the lock, so concurrent
+            # appends can arrive slightly out of order; seq_for_ts needs
+            # timestamps that never decrease
+            ts = self._last_ts = max(ts, self._last_ts)
+            seq = self._next_seq
+            self._items[seq % self.capacity] = {"seq": seq, "data": data, "ts": ts}
+            self._next_seq = seq + 1
+        return seq
+
+    def seq_for_ts(self, ts):
+        """Return the sequence number of the first record with ``ts >= ts``."""
+        with self._lock:
+            lo, hi = self.first_seq, self._next_seq
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._items[mid % self.capacity]["ts"] < ts:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+    def range(self, since=0, offset=0, limit=None):
+        """Return records with ``seq >= since``, skipping ``offset`` of them
+        and returning at most ``limit``."""
+        with self._lock:
+            start = max(since, self.first_seq) + offset
+            stop = self._next_seq
+            if limit is not None:
+                stop = min(stop, start + limit)
+            return [self._items[seq % self.capacity] for seq in range(start, stop)]
+
+
+class Deduplicator:
+    """Detects readings delivered more than once, by ``(elevator_id, seq)``.
+
+    At-least-once delivery (bridge retries, redelivery after a bridge
+    restart) can hand the API the same reading twice. Per elevator only the
+    highest ``seq`` and a bitmask of the ``window`` numbers below it are
+    kept, so memory stays small for large fleets and readings may arrive
+    somewhat out of order. A reading older than the window, or without a
+    usable ``seq``/``elevator_id``, is always accepted: a rare duplicate
+    beats a lost reading.
+    """
+
+    def __init__(self, window=DEDUP_WINDOW):
+        self.window = window
+        self._full = (1 << window) - 1
+        self._seen = {}  # elevator_id -> [highest seq, bitmask]
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    @staticmethod
+    def _key(data):
+        """``(elevator_id, seq)``, or None if ``data`` can't be tracked."""
+        seq = data.get("seq")
+        if isinstance(seq, bool) or not isinstance(seq, int):
+            return None
+        key = data.get("elevator_id")
+        if not isinstance(key, (int, str, type(None))):
+            return None
+        return key, seq
+
+    def add(self, data):
+        """Record ``data``'s seq; return False if it was seen before."""
+        tracked = self._key(data)
+        if tracked is None:
+            return True
+        key, seq = tracked
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None:
+                self._seen[key] = [seq, 1]
+                return True
+            high, mask = state
+            if seq > high:
+                shift = seq - high
+                state[0] = seq
+                state[1] = ((mask << shift) | 1) & self._full if shift < self.window else 1
+                return True
+            age = high - seq
+            if age >= self.window:
+                return True
+            if mask >> age & 1:
+                self.duplicates += 1
+                return False
+            state[1] = mask | (1 << age)
+            return True
+
+    def discard(self, data):
+        """Forget ``data``'s seq again, for a reading that was added but
+        then could not be stored: its retry must not count as a duplicate."""
+        tracked = self._key(data)
+        if tracked is None:
+            return
+        key, seq = tracked
+        with self._lock:
+            state = self._seen.get(key)
+            if state is not None and 0 <= state[0] - seq < self.window:
+                state[1] &= ~(1 << (state[0] - seq))
+
+
+class _Segment:
+    def __init__(self, base, path):
+        self.base = base
+        self.path = path
+        self.size = 0
+        # sparse index: one (seq, ts, position) entry every index_interval
+        # records, kept as parallel lists so both keys can be bisected
+        self.keys = ([], [])
+        self.positions = []
+
+    def add_index(self, seq, ts, position):
+        self.keys[0].append(seq)
+        self.keys[1].append(ts)
+        self.positions.append(position)
+
+
+class SegmentStore:
+    """Durable, append-only store of readings with a sparse time index.
+
+    Records are written to segment files as a fixed header (seq, ts, body
+    length) followed by the JSON body. Every ``index_interval`` records an
+    index entry is appended to the segment's ``.idx`` file, so a range query
+    bisects the index and then scans a memory-mapped segment from the
+    nearest entry, touching only the records it returns. Timestamps are
+    forced to be non-decreasing so the index can be bisected by time.
+    """
+
+    def __init__(self, directory, segment_bytes=STORE_SEGMENT_BYTES,
+                 index_interval=STORE_INDEX_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._segments = []
+        self._next_seq = 0
+        self._last_ts = 0.0
+        self._recover()
+
+    @property
+    def next_seq(self):
+        return self._next_seq
+
+    def _seg_path(self, base, suffix):
+        return os.path.join(self.directory, "%020d%s" % (base, suffix))
+
+    # -- recovery ----------------------------------------------------------
+
+    def _recover(self):
+        bases = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        for base in bases:
+            seg = _Segment(base, self._seg_path(base, SEGMENT_SUFFIX))
+            seg.size = os.path.getsize(seg.path)
+            idx_path = self._seg_path(base, INDEX_SUFFIX)
+            if os.path.exists(idx_path):
+                with open(idx_path, "rb") as f:
+                    raw = f.read()
+                usable = len(raw) - len(raw) % INDEX_ENTRY.size
+                for seq, ts, position in INDEX_ENTRY.iter_unpack(raw[:usable]):
+                    if position < seg.size:
+                        seg.add_index(seq, ts, position)
+            self._segments.append(seg)
+
+        if not self._segments:
+            self._segments.append(_Segment(0, self._seg_path(0, SEGMENT_SUFFIX)))
+        active = self._segments[-1]
+
+        # The active segment (and any segment whose index was lost) is
+        # re-scanned from its last index entry: this finds the next sequence
+        # number, restores unflushed index entries and cuts off a record torn
+        # by a crash.
+        for seg in self._segments:
+            if seg is active or not seg.positions:
+                seq, ts = self._rescan(seg)
+        self._next_seq = seq
+        self._last_ts = ts
+        self._writer = open(active.path, "ab")
+        self._index_writer = open(self._seg_path(active.base, INDEX_SUFFIX), "ab")
+
+    def _rescan(self, seg):
+        if seg.positions:
+            seq, ts, position = seg.keys[0][-1], seg.keys[1][-1], seg.positions[-1]
+        else:
+            seq, ts, position = seg.base, 0.0, 0
+        missing = []
+        with open(seg.path, "ab+") as f:
+            f.seek(position)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                rec_seq, rec_ts, length = RECORD_HEADER.unpack(header)
+                if len(f.read(length)) < length:
+                    break
+                if (rec_seq - seg.base) % self.index_interval == 0 and \
+                        (not seg.keys[0] or rec_seq > seg.keys[0][-1]):
+                    missing.append((rec_seq, rec_ts, position))
+                seq, ts = rec_seq + 1, rec_ts
+                position += RECORD_HEADER.size + length
+            f.truncate(position)
+        seg.size = position
+        with open(self._seg_path(seg.base, INDEX_SUFFIX), "ab") as f:
+            for entry in missing:
+                seg.add_index(*entry)
+                f.write(INDEX_ENTRY.pack(*entry))
+        return seq, ts
+
+    # -- writing -----------------------------------------------------------
+
+    def append(self, data, ts):
+        """Persist ``data`` and return its sequence number."""
+        body = json.dumps(data, separators=(",", ":")).encode()
+        with self._lock:
+            ts = max(ts, self._last_ts)
+            seg = self._segments[-1]
+            if seg.size >= self.segment_bytes:
+                seg = self._roll()
+            seq = self._next_seq
+            if (seq - seg.base) % self.index_interval == 0:
+                seg.add_index(seq, ts, seg.size)
+                self._index_writer.write(INDEX_ENTRY.pack(seq, ts, seg.size))
+                self._index_writer.flush()
+            # Hand each record to the OS right away so it survives a process
+            # kill; there is no fsync, a machine crash may lose the tail.
+            self._writer.write(RECORD_HEADER.pack(seq, ts, len(body)) + body)
+            self._writer.flush()
+            seg.size += RECORD_HEADER.size + len(body)
+            self._next_seq = seq + 1
+            self._last_ts = ts
+        return seq
+
+    def _roll(self):
+        self._writer.close()
+        self._index_writer.close()
+        seg = _Segment(self._next_seq, self._seg_path(self._next_seq, SEGMENT_SUFFIX))
+        self._segments.append(seg)
+        self._writer = open(seg.path, "ab")
+        self._index_writer = open(self._seg_path(seg.base, INDEX_SUFFIX), "ab")
+        return seg
+
+    def close(self):
+        with self._lock:
+            self._writer.close()
+            self._index_writer.close()
+
+    # -- queries -----------------------------------------------------------
+
+    def range_by_ts(self, start, end=None, limit=None):
+        """Return records with ``start <= ts <= end`` (``end`` optional)."""
+        return self._query(1, start, end, limit)
+
+    def range_by_seq(self, start, end=None, limit=None):
+        """Return records with ``start <= seq <= end`` (``end`` optional)."""
+        return self._query(0, start, end, limit)
+
+    def _query(self, field, start, end, limit):
+        with self._lock:
+            self._writer.flush()
+            self._index_writer.flush()
+            segments = [(seg, seg.size) for seg in self._segments if seg.size]
+
+        out = []
+        firsts = [seg.keys[field][0] for seg, _ in segments]
+        first = max(0, bisect.bisect_right(firsts, start) - 1)
+        for seg, size in segments[first:]:
+            if end is not None and seg.keys[field][0] > end:
+                break
+            # Start from the last index entry strictly before ``start`` so
+            # records sharing a timestamp across entries are not skipped.
+            i = max(0, bisect.bisect_left(seg.keys[field], start) - 1)
+            position = seg.positions[i]
+            with open(seg.path, "rb") as f, \
+                    mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                while position < size:
+                    header = RECORD_HEADER.unpack_from(mm, position)
+                    body_at = position + RECORD_HEADER.size
+                    position = body_at + header[2]
+                    key = header[field]
+                    if key < start:
+                        continue
+                    if end is not None and key > end:
+                        return out
+                    out.append({
+                        "seq": header[0],
+                        "data": json.loads(mm[body_at:position]),
+                        "ts": header[1],
+                    })
+                    if limit is not None and len(out) >= limit:
+                        return out
+        return out
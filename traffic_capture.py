@@ -0,0 +1,340 @@
+"""Record MQTT traffic and replay it into a broker.
+
+A capture holds every message seen on the sensor and event topics with its
+receive time, so an incident can be reproduced and measured locally::
+
+    python3 traffic_capture.py capture incident.evcap --duration 600
+    python3 traffic_capture.py info incident.evcap
+    python3 traffic_capture.py replay incident.evcap              # real time
+    python3 traffic_capture.py replay incident.evcap --speed 10   # 10x
+    python3 traffic_capture.py replay incident.evcap --asap --connections 4
+    python3 traffic_capture.py replay incident.evcap --seq renumber  # repeatable
+
+The bridge can also write the stream it receives itself (``CAPTURE_FILE``).
+
+File format: a header (magic, version) followed by records. A topic record
+(``T``, index, length, topic) is written the first time a topic appears;
+message records (``M``, ts, topic index, length, payload) refer to it by
+index, so a message costs 15 bytes plus its payload. Writers append to an
+existing capture (a restarted bridge keeps recording where it left off)
+and declare their topics afresh. A record cut short by a crash ends the
+capture.
+
+Replay spreads messages over ``--connections`` publishers by elevator (fleet
+topic id, else the payload's ``elevator_id``), so each elevator's messages
+keep their order while different elevators are published in parallel.
+"""
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import paho.mqtt.client as mqtt
+
+BROKER = os.getenv("MQTT_BROKER", "localhost")
+PORT = int(os.getenv("MQTT_PORT", "1883"))
+TOPIC_PREFIX = os.getenv("TOPIC_PREFIX", "")
+CAPTURE_TOPICS = ("elevator/sensor_data", "elevator/+/sensor_data", "elevator/events", "elevator/+/events")
+
+MAGIC = b"EVCP"
+VERSION = 1
+HEADER = struct.Struct("<4sH")
+TOPIC_RECORD = struct.Struct("<cHH")  # b"T", topic index, topic length
+MESSAGE_RECORD = struct.Struct("<cdHI")  # b"M", ts, topic index, payload length
+
+
+class CaptureWriter:
+    """Appends timestamped messages to a capture file."""
+
+    def __init__(self, path):
+        self._file = open(path, "a+b")
+        size = self._file.tell()
+        if size:
+            # drop a record torn by a crash before appending after it
+            end = _complete_end(self._file, path)
+            if end < size:
+                self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+        self._topics = {}
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, ts, topic, payload):
+        with self._lock:
+            index = self._topics.get(topic)
+            if index is None:
+                index = self._topics[topic] = len(self._topics)
+                name = topic.encode()
+                self._file.write(TOPIC_RECORD.pack(b"T", index, len(name)) + name)
+            self._file.write(MESSAGE_RECORD.pack(b"M", ts, index, len(payload)))
+            self._file.write(payload)
+            self.count += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _check_header(data, path):
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path}: not a capture file")
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: unsupported capture (magic={magic!r}, version={version})")
+
+
+def _records(f, path, payloads=True):
+    """Yield ``(end offset, message)`` for every complete record of the
+    capture open as ``f``, reading it sequentially. ``message`` is None for
+    topic records, and for every record when ``payloads`` is false: then
+    payloads are skipped by seeking rather than read."""
+    size = os.fstat(f.fileno()).st_size
+    f.seek(0)
+    _check_header(f.read(HEADER.size), path)
+    topics = {}
+    pos = HEADER.size
+    while pos < size:
+        kind = f.read(1)
+        if kind == b"T":
+            record = TOPIC_RECORD
+        elif kind == b"M":
+            record = MESSAGE_RECORD
+        else:
+            raise ValueError(f"{path}: corrupt record at byte {pos}")
+        head = kind + f.read(record.size - 1)
+        if len(head) < record.size:
+            return
+        fields = record.unpack(head)
+        end = pos + record.size + fields[-1]
+        if end > size:
+            return
+        message = None
+        if kind == b"T":
+            topics[fields[1]] = f.read(fields[-1]).decode()
+        elif payloads:
+            message = (fields[1], topics[fields[2]], f.read(fields[-1]))
+        else:
+            f.seek(end)
+        pos = end
+        yield pos, message
+
+
+def _complete_end(f, path):
+    """Offset just past the last complete record of the capture open as
+    ``f``."""
+    end = HEADER.size
+    for end, _ in _records(f, path, payloads=False):
+        pass
+    return end
+
+
+def read_capture(path):
+    """Yield ``(ts, topic, payload)`` for every complete message in ``path``,
+    streaming the file."""
+    with open(path, "rb") as f:
+        for _, message in _records(f, path):
+            if message is not None:
+                yield message
+
+
+def elevator_key(topic, payload):
+    """The elevator a message belongs to, for ordering during replay."""
+    parts = topic.split("/")
+    # fleet topics carry the id: [prefix]elevator/<id>/<kind>
+    if len(parts) >= 3 and parts[-3] == "elevator":
+        return parts[-2]
+    try:
+        return str(json.loads(payload).get("elevator_id"))
+    except (ValueError, AttributeError):
+        return None
+
+
+def partition(messages, connections):
+    """Split ``messages`` into per-connection lists, one elevator per list."""
+    parts = [[] for _ in range(connections)]
+    for message in messages:
+        key = elevator_key(message[1], message[2])
+        parts[zlib.crc32(str(key).encode()) % connections].append(message)
+    return parts
+
+
+def connect(host, port):
+    client = mqtt.Client()
+    client.connect(host, port)
+    client.loop_start()
+    return client
+
+
+def rewrite_seq(messages, mode):
+    """Return ``messages`` with each reading's ``seq`` changed by ``mode``.
+
+    The API drops a reading whose ``(elevator_id, seq)`` it has seen, so a
+    capture replayed as it is only gets through once. "renumber" numbers
+    each elevator's readings afresh, from a base taken from the clock in
+    microseconds, so every replay gets new numbers in the original order;
+    "strip" removes ``seq``; "keep" leaves the payloads alone.
+    """
+    if mode == "keep":
+        return messages
+    base = int(time.time() * 1_000_000)
+    counters = {}
+    result = []
+    for ts, topic, payload in messages:
+        try:
+            reading = json.loads(payload)
+        except ValueError:
+            reading = None
+        if isinstance(reading, dict) and "seq" in reading:
+            if mode == "strip":
+                del reading["seq"]
+            else:
+                key = elevator_key(topic, payload)
+                n = counters[key] = counters.get(key, -1) + 1
+                reading["seq"] = base + n
+            payload = json.dumps(reading, separators=(",", ":")).encode()
+        result.append((ts, topic, payload))
+    return result
+
+
+def replay(messages, host=BROKER, port=PORT, speed=1.0, connections=1, prefix="", qos=0, seq="keep"):
+    """Publish captured ``messages`` and return timing statistics.
+
+    With ``speed`` > 0 each message is published at its capture offset
+    divided by ``speed``; ``speed`` = 0 publishes as fast as possible.
+    ``prefix`` is prepended to every topic (e.g. a test worker's
+    TOPIC_PREFIX). ``seq`` is a :func:`rewrite_seq` mode, applied before
+    the clock starts.
+    """
+    if not messages:
+        return {"messages": 0}
+    messages = rewrite_seq(messages, seq)
+    t0 = messages[0][0]
+    parts = [p for p in partition(messages, max(1, connections)) if p]
+    clients = [connect(host, port) for _ in parts]
+    lateness = []
+    lock = threading.Lock()
+    start = time.monotonic() + 0.1
+
+    def play(client, part):
+        late = []
+        info = None
+        time.sleep(max(0.0, start - time.monotonic()))
+        for ts, topic, payload in part:
+            if speed > 0:
+                delay = start + (ts - t0) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    late.append(-delay)
+            info = client.publish(prefix + topic, payload, qos=qos)
+        if info is not None:
+            info.wait_for_publish()
+        with lock:
+            lateness.extend(late)
+
+    threads = [threading.Thread(target=play, args=(c, p)) for c, p in zip(clients, parts)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    for client in clients:
+        client.loop_stop()
+        client.disconnect()
+
+    lateness.sort()
+    return {
+        "messages": len(messages),
+        "connections": len(parts),
+        "capture_seconds": messages[-1][0] - t0,
+        "replay_seconds": elapsed,
+        "rate": len(messages) / elapsed if elapsed > 0 else None,
+        "late_messages": len(lateness),
+        "max_late_ms": lateness[-1] * 1000 if lateness else 0.0,
+        "p99_late_ms": lateness[int(0.99 * (len(lateness) - 1))] * 1000 if lateness else 0.0,
+    }
+
+
+def capture(path, host=BROKER, port=PORT, duration=None, prefix=TOPIC_PREFIX):
+    """Record the sensor and event topics to ``path`` until ``duration``
+    seconds pass or Ctrl-C."""
+    writer = CaptureWriter(path)
+    client = mqtt.Client()
+    client.on_message = lambda c, u, msg: writer.write(time.time(), msg.topic, msg.payload)
+    client.connect(host, port)
+    client.subscribe([(prefix + topic, 0) for topic in CAPTURE_TOPICS])
+    client.loop_start()
+    print(f"Capturing {', '.join(prefix + t for t in CAPTURE_TOPICS)} to {path}")
+    try:
+        deadline = time.monotonic() + duration if duration else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(1)
+            writer.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        writer.close()
+    print(f"Captured {writer.count} messages")
+
+
+def info(path):
+    count = 0
+    first = last = None
+    topics = {}
+    for ts, topic, _ in read_capture(path):
+        count += 1
+        first = ts if first is None else first
+        last = ts
+        topics[topic] = topics.get(topic, 0) + 1
+    return {
+        "messages": count,
+        "bytes": os.path.getsize(path),
+        "seconds": last - first if count else 0.0,
+        "topics": topics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=BROKER)
+    parser.add_argument("--port", type=int, default=PORT)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    cap = sub.add_parser("capture", help="record traffic to a file")
+    cap.add_argument("file")
+    cap.add_argument("--duration", type=float, help="seconds to record (default: until Ctrl-C)")
+    sub.add_parser("info", help="summarize a capture").add_argument("file")
+    rep = sub.add_parser("replay", help="publish a capture into the broker")
+    rep.add_argument("file")
+    rep.add_argument("--speed", type=float, default=1.0, help="replay speed factor (default: real time)")
+    rep.add_argument("--asap", action="store_true", help="publish as fast as possible")
+    rep.add_argument("--connections", type=int, default=1, help="parallel publishers (split by elevator)")
+    rep.add_argument("--prefix", default="", help="prepended to every captured topic")
+    rep.add_argument("--qos", type=int, default=0, choices=(0, 1))
+    rep.add_argument("--seq", default="keep", choices=("keep", "renumber", "strip"),
+                     help="rewrite readings' seq so the API doesn't drop a repeated replay as duplicates")
+    args = parser.parse_args()
+
+    if args.cmd == "capture":
+        capture(args.file, args.host, args.port, args.duration)
+    elif args.cmd == "info":
+        print(json.dumps(info(args.file), indent=2))
+    else:
+        messages = list(read_capture(args.file))
+        speed = 0 if args.asap else args.speed
+        result = replay(messages, args.host, args.port, speed, args.connections, args.prefix, args.qos, args.seq)
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Validation of elevator sensor readings and events, shared by the mock API
+and the bridge.
+
+The bridge runs the same checks as the API before forwarding anything, so a
+reading the API would reject with 400 never costs a request or a place in
+the queue.
+"""
+REQUIRED_FIELDS = ("position", "door_status", "weight")
+DOOR_STATES = frozenset(("open", "closed"))
+MIN_FLOOR, MAX_FLOOR = 1, 10
+MIN_WEIGHT, MAX_WEIGHT = 0, 1000
+EVENT_REQUIRED_FIELDS = ("type", "ts")
+
+
+def validate_reading(data):
+    """Return an error message for an invalid reading, or None if valid."""
+    if not isinstance(data, dict):
+        return "Missing fields"
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            return "Missing fields"
+
+    position = data["position"]
+    if not isinstance(position, int) or not MIN_FLOOR <= position <= MAX_FLOOR:
+        return "Invalid position"
+
+    door = data["door_status"]
+    if not isinstance(door, str) or door not in DOOR_STATES:
+        return "Invalid door_status"
+
+    weight = data["weight"]
+    if not isinstance(weight, int) or not MIN_WEIGHT <= weight <= MAX_WEIGHT:
+        return "Invalid weight"
+
+    # optional elevator id (fleet mode); it keys per-elevator state in the
+    # bridge and the API, so it must be a plain int or string
+    elevator_id = data.get("elevator_id")
+    if elevator_id is not None and (isinstance(elevator_id, bool) or not isinstance(elevator_id, (int, str))):
+        return "Invalid elevator_id"
+
+    # optional per-elevator sequence number, used by the API to drop
+    # readings delivered more than once
+    seq = data.get("seq")
+    if seq is not None and (isinstance(seq, bool) or not isinstance(seq, int) or seq < 0):
+        return "Invalid seq"
+
+    return None
+
+
+def validate_event(data):
+    """Return an error message for an invalid event, or None if valid."""
+    if not isinstance(data, dict):
+        return "Missing fields"
+    for field in EVENT_REQUIRED_FIELDS:
+        if field not in data:
+            return "Missing fields"
+    if not isinstance(data["type"], str) or not data["type"]:
+        return "Invalid type"
+    if isinstance(data["ts"], bool) or not isinstance(data["ts"], (int, float)):
+        return "Invalid ts"
+    return None